@@ -0,0 +1,690 @@
+"""Micro-benchmarks for the training and inference hot paths.
+
+Each benchmark builds the networks involved with random weights and random inputs, so no dataset or checkpoint is needed.
+It prints the measured time per iteration (and any extra statistics) for the variants being compared.
+
+Example:
+    Compare the live and frozen auxiliary TPN inside a pix2pix_brain generator step:
+        python benchmark.py tpn_aux --batch_size 4 --iters 20
+
+    List the available benchmarks:
+        python benchmark.py --help
+
+Use '--gpu_ids 0' to run on a GPU; the default is the CPU.
+"""
+import argparse
+import os
+import time
+import torch
+from models import networks
+from models.base_model import BaseModel
+
+
+BENCHMARKS = {}
+
+
+def register(name):
+    """Register a benchmark function under <name> so it can be selected on the command line."""
+    def wrap(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return wrap
+
+
+def sync(device):
+    """Wait for all pending kernels on <device>, so that wall-clock timings are meaningful."""
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn, device, iters=10, warmup=3):
+    """Return the mean wall-clock time (in seconds) of <fn> over <iters> calls, after <warmup> untimed calls."""
+    for _ in range(warmup):
+        fn()
+    sync(device)
+    start = time.time()
+    for _ in range(iters):
+        fn()
+    sync(device)
+    return (time.time() - start) / iters
+
+
+def count_parameters(net):
+    """Return the number of parameters of <net>"""
+    return sum(param.numel() for param in net.parameters())
+
+
+def count_flops(net, input):
+    """Return the number of floating-point operations of one forward pass of <net> on <input>.
+
+    Only convolutions and linear layers are counted (a multiply-add counts as 2 operations), which dominate the cost.
+    """
+    flops = []
+
+    def conv_hook(module, inputs, output):
+        kernel_ops = module.weight[0].numel()  # in_channels / groups * kH * kW
+        flops.append(2 * output.numel() * kernel_ops)
+
+    def linear_hook(module, inputs, output):
+        flops.append(2 * output.numel() * module.in_features)
+
+    hooks = []
+    for module in net.modules():
+        if isinstance(module, (torch.nn.Conv2d, torch.nn.ConvTranspose2d)):
+            hooks.append(module.register_forward_hook(conv_hook))
+        elif isinstance(module, torch.nn.Linear):
+            hooks.append(module.register_forward_hook(linear_hook))
+    with torch.no_grad():
+        net(input)
+    for hook in hooks:
+        hook.remove()
+    return sum(flops)
+
+
+def peak_memory(fn, device):
+    """Return the peak memory (in bytes) used while running <fn> once.
+
+    On a GPU this is the peak allocated CUDA memory. On the CPU, PyTorch has no allocator statistics, so we return the
+    total size of the tensors saved for backward (the activation memory), using saved-tensor hooks when available.
+    """
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+        fn()
+        sync(device)
+        return torch.cuda.max_memory_allocated(device)
+    if not hasattr(torch.autograd, 'graph') or not hasattr(torch.autograd.graph, 'saved_tensors_hooks'):
+        return float('nan')
+    saved = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage() if hasattr(tensor, 'untyped_storage') else tensor.storage()
+        saved[storage.data_ptr()] = storage.nbytes() if hasattr(storage, 'nbytes') else storage.size() * tensor.element_size()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        fn()
+    return sum(saved.values())
+
+
+def report(name, seconds, baseline=None):
+    """Print the time per iteration for one variant (and its speedup over <baseline>, in seconds)."""
+    message = '%-32s %9.2f ms/iter' % (name, seconds * 1000)
+    if baseline is not None:
+        message += '   speedup x%.2f' % (baseline / seconds)
+    print(message)
+
+
+def make_model(device, model, *argv):
+    """Create a <model> for training on <device>, with the default training options overridden by <argv>."""
+    import models
+    from options.train_options import TrainOptions
+    parser = TrainOptions().initialize(argparse.ArgumentParser())
+    parser = models.get_option_setter(model)(parser, True)
+    opt = parser.parse_args(['--dataroot', '.', '--model', model] + list(argv))
+    opt.isTrain = True
+    opt.gpu_ids = [device.index or 0] if device.type == 'cuda' else []
+    return models.create_model(opt)
+
+
+@register('tpn_aux')
+def bench_tpn_aux(args, device):
+    """Generator step of pix2pix_brain with the auxiliary TPN live (as before) and frozen."""
+    netG = networks.define_G(1, 1, args.ngf, 'unet_256_TPN', 'batch', True).to(device)
+    real_A = torch.randn(args.batch_size, 1, 256, 256, device=device)
+    true_time = torch.rand(args.batch_size, device=device) * 50
+    results = []
+    for mode in ['live', 'frozen', 'frozen_channels_last']:
+        tpn = networks.define_D(2, 16, 'time_input', norm='batch').to(device)
+        if mode != 'live':
+            for param in tpn.parameters():
+                param.requires_grad = False
+            tpn.eval()
+        if mode == 'frozen_channels_last':
+            tpn = networks.accelerate_net(tpn, 'channels_last')
+
+        def step():
+            netG.zero_grad()
+            fake_B = netG(real_A, true_time)
+            fake_AB = torch.cat((real_A, fake_B), 1)
+            if mode == 'frozen_channels_last':
+                fake_AB = fake_AB.contiguous(memory_format=torch.channels_last)
+            fake_time = tpn(fake_AB)
+            loss = torch.nn.functional.l1_loss(fake_time, true_time.view(-1, 1))
+            loss.backward()
+        results.append((mode, time_fn(step, device, args.iters)))
+    for mode, seconds in results:
+        report(mode, seconds, results[0][1])
+
+
+@register('fold_time')
+def bench_fold_time(args, device):
+    """Constant time channel folding in the TPN generator and the conditional discriminator.
+
+    The folded path must match the concatenation path exactly up to floating-point summation order. We check
+    this in float64, where any error in the border handling would show up far above the 1e-10 tolerance.
+    """
+    netG = networks.define_G(1, 1, args.ngf, 'unet_256_TPN', 'batch', False).to(device)
+    netD = networks.define_D(3, args.ndf, 'basic', norm='batch').to(device)
+    real_A = torch.randn(args.batch_size, 1, 256, 256, device=device)
+    real_B = torch.randn(args.batch_size, 1, 256, 256, device=device)
+    true_time = torch.rand(args.batch_size, device=device) * 50
+
+    def run(fold, dtype=torch.float32):
+        networks.set_constant_folding(netG, fold)
+        A, B, t = real_A.to(dtype), real_B.to(dtype), true_time.to(dtype)
+        fake_B = netG(A, t)
+        if fold:
+            return fake_B, netD(torch.cat((A, B), 1), t.view(-1, 1))
+        return fake_B, netD(torch.cat((t.view(-1, 1, 1, 1).expand_as(A), A, B), 1))
+
+    netG.eval()  # make BatchNorm deterministic across the two runs
+    netD.eval()
+    with torch.no_grad():
+        netG.double()
+        netD.double()
+        (g_cat, d_cat), (g_fold, d_fold) = run(False, torch.float64), run(True, torch.float64)
+        netG.float()
+        netD.float()
+    max_diff = max((g_cat - g_fold).abs().max().item(), (d_cat - d_fold).abs().max().item())
+    print('max abs difference (float64): %.3e' % max_diff)
+    assert max_diff < 1e-10, 'folded time channels do not match the concatenation path'
+
+    netG.train()
+    netD.train()
+    baseline = None
+    for fold in [False, True]:
+        def step():
+            netG.zero_grad()
+            netD.zero_grad()
+            fake_B, pred = run(fold)
+            (fake_B.mean() + pred.mean()).backward()
+        seconds = time_fn(step, device, args.iters)
+        baseline = baseline or seconds
+        report('folded' if fold else 'concatenated', seconds, baseline)
+
+
+@register('time_pool')
+def bench_time_pool(args, device):
+    """Parameters, FLOPs and training throughput of the time_input network against the pooled variant at several sizes."""
+    configs = [('time_input', 256), ('time_input_pool', 256), ('time_input_pool', 128), ('time_input_pool', 64)]
+    print('%-24s %10s %12s %12s' % ('network', 'params (M)', 'GFLOPs/img', 'samples/s'))
+    for netD, size in configs:
+        net = networks.define_D(2, args.ndf, netD, norm='batch').to(device)
+        optimizer = torch.optim.Adam(net.parameters())
+        real_AB = torch.randn(args.batch_size, 2, size, size, device=device)
+        true_time = torch.rand(args.batch_size, 1, device=device) * 50
+
+        def step():
+            optimizer.zero_grad()
+            torch.nn.functional.mse_loss(net(real_AB), true_time).backward()
+            optimizer.step()
+        seconds = time_fn(step, device, args.iters)
+        net.eval()
+        flops = count_flops(net, real_AB[:1])
+        print('%-24s %10.3f %12.3f %12.1f' % ('%s@%d' % (netD, size), count_parameters(net) / 1e6, flops / 1e9, args.batch_size / seconds))
+
+
+@register('autoenc')
+def bench_autoenc(args, device):
+    """Parameters, training memory and throughput of the fully connected autoencoder against the conv-bottleneck one."""
+    diff_map = torch.randn(args.batch_size, 1, 256, 256, device=device)
+    print('%-16s %10s %12s %12s' % ('network', 'params (M)', 'memory (MB)', 'samples/s'))
+    for netAE in ['autoenc', 'autoenc_conv']:
+        net = networks.define_D(1, args.ndf, netAE, norm='batch').to(device)
+        optimizer = torch.optim.Adam(net.parameters())
+
+        def step():
+            optimizer.zero_grad()
+            torch.nn.functional.l1_loss(net(diff_map), diff_map).backward()
+            optimizer.step()
+        seconds = time_fn(step, device, args.iters)
+        memory = peak_memory(step, device)
+        print('%-16s %10.3f %12.1f %12.1f' % (netAE, count_parameters(net) / 1e6, memory / 2 ** 20, args.batch_size / seconds))
+
+
+@register('crop_foreground')
+def bench_crop_foreground(args, device):
+    """FLOPs and losses of full-frame pix2pix against '--crop_foreground' with '--crop_loss crop'.
+
+    The batch is a synthetic slice: a bright disc (the anatomy) of diameter 100 in an empty 256x256 frame.
+    Given the same G output, the area-scaled L1 loss on D's box equals the full-frame one. The losses below still differ,
+    because G sees less context at the box borders and D averages over fewer (and differently padded) patches.
+    """
+    size = 256
+    y, x = torch.meshgrid(torch.arange(size).float(), torch.arange(size).float())
+    disc = (((y - 120) ** 2 + (x - 140) ** 2) < 50 ** 2).float().view(1, 1, size, size)
+    real_A = (disc * torch.rand(args.batch_size, 1, size, size) * 2 - 1).to(device)
+    real_B = (disc * torch.rand(args.batch_size, 1, size, size) * 2 - 1).to(device)
+    criterionGAN = networks.GANLoss('vanilla').to(device)
+    print('%-16s %-22s %12s %12s %10s %10s' % ('netG', 'box G / box D', 'GFLOPs G', 'GFLOPs D', 'L1', 'GAN'))
+    for netG in ['unet_256', 'unet_128', 'resnet_9blocks']:
+        G = networks.define_G(1, 1, args.ngf, netG, 'batch').to(device).eval()
+        D = networks.define_D(2, args.ndf, 'basic', norm='batch').to(device).eval()
+        box_G = networks.foreground_box([real_A, real_B], *networks.size_multiple(netG))
+        box_D = networks.round_box(box_G, (size, size), *networks.size_multiple('basic'))
+        with torch.no_grad():
+            for name, crop_G, crop_D in [('full', (0, size, 0, size), (0, size, 0, size)), ('crop', box_G, box_D)]:
+                fake_B = networks.paste_box(G(networks.crop_box(real_A, crop_G)), crop_G, (size, size))
+                fake_AB = networks.crop_box(torch.cat((real_A, fake_B), 1), crop_D)
+                area = float((crop_D[1] - crop_D[0]) * (crop_D[3] - crop_D[2])) / (size * size)
+                l1 = torch.nn.functional.l1_loss(networks.crop_box(fake_B, crop_D), networks.crop_box(real_B, crop_D)).item() * area
+                gan = criterionGAN(D(fake_AB), True).item()
+                boxes = '%dx%d / %dx%d' % (crop_G[1] - crop_G[0], crop_G[3] - crop_G[2], crop_D[1] - crop_D[0], crop_D[3] - crop_D[2])
+                flops_G = count_flops(G, networks.crop_box(real_A, crop_G)) / 1e9
+                flops_D = count_flops(D, fake_AB) / 1e9
+                print('%-16s %-22s %12.3f %12.3f %10.5f %10.5f' % (netG + ' ' + name, boxes, flops_G, flops_D, l1, gan))
+
+
+@register('grayscale')
+def bench_grayscale(args, device):
+    """Loading throughput and batch memory of the brain dataset: RGB decoding (as before), 'L' decoding, and uint8 batches.
+
+    It writes 64 synthetic 512x256 grayscale {A,B} pairs to a temporary directory. Each loaded batch is moved to the
+    device and normalized there, as <BaseModel.image_to_device> does.
+    """
+    import shutil
+    import tempfile
+    import numpy as np
+    from PIL import Image
+    from data.brain_dataset import BrainDataset
+    from models.base_model import BaseModel
+
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, 'train'))
+    for i in range(64):
+        Image.fromarray(np.random.randint(0, 256, (256, 512), dtype=np.uint8)).save(os.path.join(root, 'train', '%04d_%dw.png' % (i, i % 50 + 1)))
+    print('%-10s %14s %12s' % ('path', 'batch (MB)', 'samples/s'))
+    for name, uint8 in [('rgb', False), ('gray', False), ('gray_uint8', True)]:
+        opt = argparse.Namespace(dataroot=root, phase='train', max_dataset_size=float('inf'), direction='AtoB', input_nc=1, output_nc=1,
+                                  preprocess='resize_and_crop', load_size=256, crop_size=256, rotate=None, no_flip=True, collate_uint8=uint8)
+        dataset = BrainDataset(opt)
+        dataset.grayscale = name != 'rgb'
+        loader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size, num_workers=0)
+        model = argparse.Namespace(device=device)
+
+        def epoch():
+            for data in loader:
+                for key in ['A', 'B', 'diff_map']:
+                    BaseModel.image_to_device(model, data[key])
+        seconds = time_fn(epoch, device, iters=max(1, args.iters // 5), warmup=1)
+        batch = next(iter(loader))
+        memory = sum(batch[key].numel() * batch[key].element_size() for key in ['A', 'B', 'diff_map'])
+        print('%-10s %14.2f %12.1f' % (name, memory / 2 ** 20, len(dataset) / seconds))
+    shutil.rmtree(root)
+
+
+@register('amp')
+def bench_amp(args, device):
+    """pix2pix training step (unet_256 generator, basic discriminator) in float32 and with '--amp'.
+
+    With '--amp' the networks run under torch.autocast (bfloat16 on the CPU, float16 with gradient scaling on a GPU),
+    while the GAN loss stays in float32, as in <BaseModel.train_step>.
+    """
+    if not hasattr(torch, 'autocast'):
+        print('torch.autocast is not supported by this PyTorch version')
+        return
+    netG = networks.define_G(1, 1, args.ngf, 'unet_256', 'batch').to(device)
+    netD = networks.define_D(2, args.ndf, 'basic', norm='batch').to(device)
+    optimizer_G = torch.optim.Adam(netG.parameters())
+    optimizer_D = torch.optim.Adam(netD.parameters())
+    criterionGAN = networks.GANLoss('vanilla').to(device)
+    real_A = torch.randn(args.batch_size, 1, 256, 256, device=device)
+    real_B = torch.randn(args.batch_size, 1, 256, 256, device=device)
+    amp_dtype = torch.float16 if device.type == 'cuda' else torch.bfloat16
+    baseline = None
+    for amp in [False, True]:
+        scaler = torch.cuda.amp.GradScaler(enabled=amp and device.type == 'cuda')
+
+        def step():
+            with torch.autocast(device.type, dtype=amp_dtype, enabled=amp):
+                fake_B = netG(real_A)
+                optimizer_D.zero_grad()
+                loss_D = (criterionGAN(netD(torch.cat((real_A, fake_B.detach()), 1)), False) +
+                          criterionGAN(netD(torch.cat((real_A, real_B), 1)), True)) * 0.5
+            scaler.scale(loss_D).backward()
+            scaler.step(optimizer_D)
+            with torch.autocast(device.type, dtype=amp_dtype, enabled=amp):
+                optimizer_G.zero_grad()
+                loss_G = criterionGAN(netD(torch.cat((real_A, fake_B), 1)), True) + \
+                    torch.nn.functional.l1_loss(fake_B, real_B) * 100
+            scaler.scale(loss_G).backward()
+            scaler.step(optimizer_G)
+            scaler.update()
+        seconds = time_fn(step, device, args.iters)
+        baseline = baseline or seconds
+        report('amp (%s)' % str(amp_dtype).split('.')[-1] if amp else 'float32', seconds, baseline)
+
+
+@register('checkpoint_G')
+def bench_checkpoint_G(args, device):
+    """Peak memory and time of a generator training step with '--checkpoint_G' 0 (off), 1 and 2 at several crop sizes."""
+    print('%-16s %6s %10s %14s %12s' % ('netG', 'size', 'every', 'memory (MB)', 'ms/iter'))
+    for netG, sizes in [('unet_256', [256, 512, 1024]), ('unet_256_TPN', [256, 512]), ('resnet_9blocks', [256, 512, 1024])]:
+        for size in sizes:
+            real_A = torch.randn(args.batch_size, 1, size, size, device=device)
+            true_time = torch.rand(args.batch_size, device=device) * 50
+            for every in [0, 1, 2]:
+                net = networks.define_G(1, 1, args.ngf, netG, 'batch').to(device)
+                networks.set_checkpointing(net, every)
+                inputs = (real_A, true_time) if netG.endswith('TPN') else (real_A,)
+
+                def step():
+                    net.zero_grad()
+                    net(*inputs).mean().backward()
+                memory = peak_memory(step, device)
+                seconds = time_fn(step, device, args.iters, warmup=1)
+                print('%-16s %6d %10d %14.1f %12.2f' % (netG, size, every, memory / 2 ** 20, seconds * 1000))
+
+
+@register('resnet_rev')
+def bench_resnet_rev(args, device):
+    """Peak memory, throughput and parameters of a generator training step: resnet_9blocks vs. resnet_9blocks_rev."""
+    print('%-20s %6s %14s %12s %12s' % ('netG', 'size', 'memory (MB)', 'img/s', 'params (M)'))
+    for size in [256, 512]:
+        real_A = torch.randn(args.batch_size, 1, size, size, device=device)
+        for netG in ['resnet_9blocks', 'resnet_9blocks_rev']:
+            net = networks.define_G(1, 1, args.ngf, netG, 'instance').to(device)
+
+            def step():
+                net.zero_grad()
+                net(real_A).mean().backward()
+            memory = peak_memory(step, device)
+            seconds = time_fn(step, device, args.iters, warmup=1)
+            print('%-20s %6d %14.1f %12.1f %12.2f' % (netG, size, memory / 2 ** 20, args.batch_size / seconds,
+                                                       count_parameters(net) / 1e6))
+
+
+@register('fused_batch')
+def bench_fused_batch(args, device):
+    """Time of a CycleGAN training step with and without '--fused_batch', and the largest difference between their losses.
+
+    Both models start from the same weights, and the losses of their first steps are compared.
+    """
+    data = {'A': torch.randn(args.batch_size, 3, 256, 256), 'B': torch.randn(args.batch_size, 3, 256, 256), 'A_paths': [], 'B_paths': []}
+    separate, fused = [make_model(device, 'cycle_gan', '--ngf', str(args.ngf), '--ndf', str(args.ndf), '--pool_size', '0', *flags)
+                       for flags in [[], ['--fused_batch']]]
+    for name in separate.model_names:
+        getattr(fused, 'net' + name).load_state_dict(getattr(separate, 'net' + name).state_dict())
+    losses = []
+    for model in [separate, fused]:
+        model.set_input(data)
+        model.optimize_parameters()
+        losses.append(model.get_current_losses())
+    print('max loss difference: %.2e' % max(abs(losses[0][name] - losses[1][name]) for name in losses[0]))
+    baseline = time_fn(separate.optimize_parameters, device, args.iters)
+    report('separate calls', baseline)
+    report('fused_batch', time_fn(fused.optimize_parameters, device, args.iters), baseline)
+
+
+@register('image_pool')
+def bench_image_pool(args, device):
+    """Time of an ImagePool query (with a full pool of 50) at batch sizes 1-64: the previous per-image Python loop
+    against the preallocated tensor pool, stored on <device> and, on a GPU, in pinned host memory."""
+    import random
+    from util.image_pool import ImagePool
+
+    def list_query(pool, images):  # the per-image loop that ImagePool used before
+        return_images = []
+        for image in images:
+            image = torch.unsqueeze(image.data, 0)
+            if len(pool) < 50:
+                pool.append(image)
+                return_images.append(image)
+            elif random.uniform(0, 1) > 0.5:
+                random_id = random.randint(0, 49)
+                tmp = pool[random_id].clone()
+                pool[random_id] = image
+                return_images.append(tmp)
+            else:
+                return_images.append(image)
+        return torch.cat(return_images, 0)
+
+    variants = ['list', 'tensor'] + (['tensor (pinned host)'] if device.type == 'cuda' else [])
+    print('%-8s' % 'batch' + ''.join('%24s' % ('%s ms' % name) for name in variants))
+    for batch_size in [1, 2, 4, 8, 16, 32, 64]:
+        images = torch.randn(batch_size, 3, 256, 256, device=device)
+        timings = []
+        for name in variants:
+            pool = [] if name == 'list' else ImagePool(50, pin_memory=name != 'tensor')
+
+            def query():
+                return list_query(pool, images) if name == 'list' else pool.query(images)
+            for _ in range(50 // batch_size + 1):  # fill the pool
+                query()
+            timings.append(time_fn(query, device, args.iters))
+        print('%-8d' % batch_size + ''.join('%24.3f' % (seconds * 1000) for seconds in timings))
+
+
+@register('lazy_gp')
+def bench_lazy_gp(args, device):
+    """Training throughput of pix2pix and cycle_gan without a gradient penalty and with '--gp_every' 1, 4 and 16.
+
+    Each variant is timed over a multiple of 16 steps, so that every k sees whole regularization periods.
+    """
+    iters = max(16, args.iters // 16 * 16)
+    for model_name in ['pix2pix', 'cycle_gan']:
+        data = {'A': torch.randn(args.batch_size, 3, 256, 256), 'B': torch.randn(args.batch_size, 3, 256, 256), 'A_paths': [], 'B_paths': []}
+        baseline = None
+        for gp_type, every in [(None, 0), ('wgangp', 1), ('wgangp', 4), ('wgangp', 16), ('r1', 1), ('r1', 4), ('r1', 16)]:
+            flags = ['--gan_mode', 'wgangp', '--ngf', str(args.ngf), '--ndf', str(args.ndf)]
+            if gp_type is not None:
+                flags += ['--lambda_gp', '10', '--gp_type', gp_type, '--gp_every', str(every)]
+            model = make_model(device, model_name, *flags)
+            model.set_input(data)
+            seconds = time_fn(model.optimize_parameters, device, iters)
+            baseline = baseline or seconds
+            report('%s %s' % (model_name, 'no penalty' if gp_type is None else '%s every %d' % (gp_type, every)), seconds, baseline)
+
+
+@register('step_overhead')
+def bench_step_overhead(args, device):
+    """Per-step overhead of the optimizer machinery of pix2pix and cycle_gan (run it on the CPU with small networks):
+    the Adam update of each implementation, zero_grad with and without set_to_none, and the requires_grad switches
+    of the discriminators, looping over net.parameters() as before or through the cached <set_requires_grad>."""
+    for model_name, netG, size in [('pix2pix', 'unet_128', 128), ('cycle_gan', 'resnet_6blocks', 64)]:
+        data = {'A': torch.randn(args.batch_size, 3, size, size), 'B': torch.randn(args.batch_size, 3, size, size), 'A_paths': [], 'B_paths': []}
+        print('%s (%s at %dpx, ngf=%d, ndf=%d)' % (model_name, netG, size, args.ngf, args.ndf))
+        baseline = None
+        for impl in ['for_loop', 'foreach', 'fused']:
+            model = make_model(device, model_name, '--netG', netG, '--ngf', str(args.ngf), '--ndf', str(args.ndf), '--adam_impl', impl)
+            model.set_input(data)
+            model.optimize_parameters()  # creates the gradients and the optimizer state
+
+            def step():
+                for optimizer in model.optimizers:
+                    optimizer.step()
+            seconds = time_fn(step, device, args.iters)
+            baseline = baseline or seconds
+            report('  Adam step (%s)' % impl, seconds, baseline)
+        for optimizer in model.optimizers:  # fill the gradients again
+            for group in optimizer.param_groups:
+                for param in group['params']:
+                    param.grad = torch.zeros_like(param)
+        seconds = time_fn(lambda: [optimizer.zero_grad(set_to_none=False) for optimizer in model.optimizers], device, args.iters)
+        report('  zero_grad (fill with zeros)', seconds)
+        report('  zero_grad (set to None)', time_fn(lambda: [model.zero_grad(optimizer) for optimizer in model.optimizers], device, args.iters), seconds)
+        nets = [getattr(model, 'net' + name) for name in model.model_names if name.startswith('D')]
+
+        def loop_switch():
+            for requires_grad in [False, True]:
+                for net in nets:
+                    for param in net.parameters():
+                        param.requires_grad = requires_grad
+        cached = time_fn(lambda: [model.set_requires_grad(nets, flag) for flag in [False, True]], device, args.iters)
+        seconds = time_fn(loop_switch, device, args.iters)  # after the cached switches, which assume they set the flags
+        report('  requires_grad switch (loop)', seconds)
+        report('  requires_grad switch (cached)', cached, seconds)
+
+
+@register('compile_step')
+def bench_compile_step(args, device):
+    """Compile time, steady-state step time and retracing of pix2pix and cycle_gan with '--compile', against eager.
+
+    After the steady-state timing, the compiled model gets a batch of another size, as with '--crop_foreground' or
+    'scale_width', to show the retracing it causes.
+    """
+    for model_name, size, new_size in [('pix2pix', 256, 512), ('cycle_gan', 256, 192)]:
+        data = {'A': torch.randn(args.batch_size, 3, size, size), 'B': torch.randn(args.batch_size, 3, size, size), 'A_paths': [], 'B_paths': []}
+        baseline = None
+        for compiled in [False, True]:
+            model = make_model(device, model_name, '--ngf', str(args.ngf), '--ndf', str(args.ndf), *(['--compile'] if compiled else []))
+            model.set_input(data)
+            start = time.time()
+            model.optimize_parameters()
+            sync(device)
+            first = time.time() - start
+            seconds = time_fn(model.optimize_parameters, device, args.iters)
+            baseline = baseline or seconds
+            report('%s %s' % (model_name, 'compiled' if compiled else 'eager'), seconds, baseline)
+            if not compiled:
+                continue
+            traces = sum(len(record['traces']) for record in model.compile_stats.values())
+            print('  first step %.1f s, %d compilations, %.1f s compiling' % (
+                first, traces, sum(seconds for record in model.compile_stats.values() for _, seconds in record['traces'])))
+            for name, record in model.compile_stats.items():
+                if record['failed']:
+                    print('  %s fell back to eager: %s' % (name, record['failed']))
+            model.set_input({'A': torch.randn(args.batch_size, 3, new_size, new_size), 'B': torch.randn(args.batch_size, 3, new_size, new_size), 'A_paths': [], 'B_paths': []})
+            model.optimize_parameters()
+            print('  %d retracing compilations for %dpx inputs' % (sum(len(record['traces']) for record in model.compile_stats.values()) - traces, new_size))
+
+
+@register('fork_branches')
+def bench_fork_branches(args, device):
+    """CycleGAN training step on the CPU with the branches run one after the other (all intra-op threads) and with
+    '--fork_branches' (two branch threads) at several intra-op thread counts."""
+    cores = torch.get_num_threads()
+    data = {'A': torch.randn(args.batch_size, 3, 256, 256), 'B': torch.randn(args.batch_size, 3, 256, 256), 'A_paths': [], 'B_paths': []}
+    baseline = None
+    for intra in [0] + sorted(set([max(1, cores // 4), max(1, cores // 2), cores])):
+        torch.set_num_threads(intra or cores)
+        flags = ['--fork_branches'] if intra else []
+        model = make_model(device, 'cycle_gan', '--ngf', str(args.ngf), '--ndf', str(args.ndf), *flags)
+        model.set_input(data)
+        seconds = time_fn(model.optimize_parameters, device, args.iters)
+        baseline = baseline or seconds
+        report('fork, %d intra-op threads' % intra if intra else 'sequential, %d threads' % cores, seconds, baseline)
+    torch.set_num_threads(cores)
+
+
+@register('lean_step')
+def bench_lean_step(args, device):
+    """Memory held by pix2pix and cycle_gan between training steps, and (on a GPU) the peak memory of a step, with and
+    without '--lean_step'.
+
+    The held memory counts the storages of the model's tensor attributes and of the tensors saved by their autograd
+    graphs (without the weights), i.e. what the next step's forward pass has to allocate on top of.
+    """
+    def tensors(model):  # tensor attributes of <model> and of its auxiliary models (e.g. the TPN of pix2pix_brain)
+        values = list(vars(model).values())
+        return [value for value in values if torch.is_tensor(value)] + \
+            [tensor for value in values if isinstance(value, BaseModel) for tensor in tensors(value)]
+
+    def held_bytes(model):
+        storages, stack, seen = {}, tensors(model), set()
+        nodes = [value.grad_fn for value in stack if value.grad_fn is not None]
+        for tensor in stack:
+            storages[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+        while nodes:  # tensors saved by the graphs that are still referenced
+            node = nodes.pop()
+            if node is None or node in seen:
+                continue
+            seen.add(node)
+            for attr in dir(node):
+                if attr.startswith('_saved_'):
+                    try:
+                        value = getattr(node, attr)
+                    except RuntimeError:  # already freed by the backward pass
+                        continue
+                    if torch.is_tensor(value):
+                        storages[value.data_ptr()] = value.numel() * value.element_size()
+            nodes.extend(next_node for next_node, _ in node.next_functions)
+        for name in model.model_names:  # the weights are held anyway
+            for param in getattr(model, 'net' + name).parameters():
+                storages.pop(param.data_ptr(), None)
+        return sum(storages.values())
+
+    print('%-12s %6s %-8s %16s %16s' % ('model', 'size', 'step', 'held (MB)', 'peak (MB)'))
+    for model_name, size in [('pix2pix', 256), ('pix2pix', 512), ('cycle_gan', 256)]:
+        data = {'A': torch.randn(args.batch_size, 3, size, size), 'B': torch.randn(args.batch_size, 3, size, size), 'A_paths': [], 'B_paths': []}
+        for lean in [False, True]:
+            model = make_model(device, model_name, '--ngf', str(args.ngf), '--ndf', str(args.ndf), *(['--lean_step'] if lean else []))
+
+            def step():
+                model.set_input(data)
+                model.train_step()
+                if lean:
+                    model.release_step(keep_visuals=False)
+            step()
+            peak = float('nan')
+            if device.type == 'cuda':
+                torch.cuda.reset_peak_memory_stats(device)
+                step()
+                peak = torch.cuda.max_memory_allocated(device) / 2 ** 20
+            print('%-12s %6d %-8s %16.1f %16.1f' % (model_name, size, 'lean' if lean else 'default', held_bytes(model) / 2 ** 20, peak))
+
+
+@register('progressive')
+def bench_progressive(args, device):
+    """Wall-clock time for pix2pix (resnet_6blocks) to reach a validation L1 loss at 256px, training at a fixed 256px
+    crop against the progressive schedule 64 -> 128 -> 256 of '--progressive_sizes'.
+
+    The task is synthetic and resolution independent (B is a smoothed, channel-swapped A). The fixed-resolution run
+    trains for 30 * <iters> steps and its final validation loss (+5%) is the target; the progressive run spends a third
+    of those steps at each size and continues at 256px until it reaches the target (at most twice as many steps).
+    """
+    def batch(size, n):
+        A = torch.nn.functional.interpolate(torch.randn(n, 3, size // 8, size // 8), size=(size, size), mode='bilinear', align_corners=False).tanh()
+        B = torch.nn.functional.avg_pool2d(A.flip(1), 3, stride=1, padding=1)
+        return {'A': A, 'B': B, 'A_paths': [], 'B_paths': []}
+
+    val = batch(256, 8)
+    steps, every = 30 * args.iters, args.iters
+
+    def run(sizes, target=None):
+        torch.manual_seed(0)
+        model = make_model(device, 'pix2pix', '--netG', 'resnet_6blocks', '--ngf', str(args.ngf), '--ndf', str(args.ndf))
+        start, history = time.time(), []
+        for step in range(2 * steps if target is not None else steps):
+            model.set_input(batch(sizes[min(step * len(sizes) // steps, len(sizes) - 1)], args.batch_size))
+            model.train_step()
+            if (step + 1) % every == 0:
+                sync(device)
+                seconds = time.time() - start
+                with torch.no_grad():
+                    model.set_input(val)
+                    model.forward()
+                    loss = float(torch.nn.functional.l1_loss(model.fake_B, model.real_B))
+                print('  %-24s step %5d  %8.1f s  val L1 %.4f' % (' -> '.join(str(size) for size in sizes), step + 1, seconds, loss))
+                start = time.time() - seconds  # do not count the validation
+                history.append((seconds, loss))
+                if target is not None and loss <= target:
+                    break
+        return history
+
+    def time_to(history, target):
+        return next((seconds for seconds, loss in history if loss <= target), float('nan'))
+
+    fixed = run([256])
+    target = fixed[-1][1] * 1.05
+    prog = run([64, 128, 256], target)
+    print('time to reach val L1 %.4f: fixed 256px %.1f s, progressive %.1f s' % (target, time_to(fixed, target), time_to(prog, target)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS.keys()), help='which benchmark to run')
+    parser.add_argument('--gpu_ids', type=str, default='-1', help='gpu id to run on, e.g. 0. use -1 for CPU')
+    parser.add_argument('--batch_size', type=int, default=1, help='input batch size')
+    parser.add_argument('--ngf', type=int, default=64, help='# of gen filters in the last conv layer')
+    parser.add_argument('--ndf', type=int, default=64, help='# of discrim filters in the first conv layer')
+    parser.add_argument('--iters', type=int, default=10, help='# of timed iterations per variant')
+    parser.add_argument('--threads', type=int, default=0, help='# of intra-op CPU threads; 0 keeps the PyTorch default')
+    args = parser.parse_args()
+
+    gpu_id = int(args.gpu_ids.split(',')[0])
+    device = torch.device('cuda:%d' % gpu_id) if gpu_id >= 0 else torch.device('cpu')
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    BENCHMARKS[args.benchmark](args, device)
@@ -11,6 +11,7 @@ Now you can use the dataset class by specifying flag '--dataset_mode dummy'.
 See our template dataset class 'template_dataset.py' for more details.
 """
 import importlib
+from copy import deepcopy
 import torch.utils.data
 from data.base_dataset import BaseDataset
 
@@ -59,6 +60,23 @@ def create_dataset(opt):
     return dataset
 
 
+def create_eval_dataset(opt, phase):
+    """Create a non-shuffled, non-augmented dataset over the first <opt.num_eval> samples of <phase>
+
+    Used by the evaluation passes of 'train.py' ('--val_phase') and 'train_time.py'; <opt> is not modified.
+    """
+    eval_opt = deepcopy(opt)
+    eval_opt.isTrain = False
+    eval_opt.phase = phase
+    eval_opt.serial_batches = True
+    eval_opt.no_flip = True
+    eval_opt.rotate = None
+    eval_opt.load_size = opt.crop_size  # no random crop, as in test options
+    eval_opt.batch_size = opt.eval_batch_size
+    eval_opt.max_dataset_size = opt.num_eval
+    return create_dataset(eval_opt)
+
+
 class CustomDatasetDataLoader():
     """Wrapper class of Dataset class that performs multi-threaded data loading"""
 
@@ -72,10 +90,15 @@ class CustomDatasetDataLoader():
         dataset_class = find_dataset_using_name(opt.dataset_mode)
         self.dataset = dataset_class(opt)
         print("dataset [%s] was created" % type(self.dataset).__name__)
+        sample_weights = getattr(self.dataset, 'sample_weights', None)
+        sampler = None
+        if sample_weights is not None and not opt.serial_batches:  # e.g. down-weighted background slices
+            sampler = torch.utils.data.WeightedRandomSampler(sample_weights, len(sample_weights))
         self.dataloader = torch.utils.data.DataLoader(
             self.dataset,
             batch_size=opt.batch_size,
-            shuffle=not opt.serial_batches,
+            shuffle=not opt.serial_batches and sampler is None,
+            sampler=sampler,
             num_workers=int(opt.num_threads))
 
     def load_data(self):
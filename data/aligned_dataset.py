@@ -1,6 +1,7 @@
 import os.path
 from data.base_dataset import BaseDataset, get_params, get_transform
 from data.image_folder import make_dataset
+from data import foreground_index
 from PIL import Image
 
 
@@ -11,6 +12,11 @@ class AlignedDataset(BaseDataset):
     During test time, you need to prepare a directory '/path/to/data/test'.
     """
 
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        """Add the foreground filtering options (see data/foreground_index.py)."""
+        return foreground_index.modify_commandline_options(parser)
+
     def __init__(self, opt):
         """Initialize this dataset class.
 
@@ -20,9 +26,11 @@ class AlignedDataset(BaseDataset):
         BaseDataset.__init__(self, opt)
         self.dir_AB = os.path.join(opt.dataroot, opt.phase)  # get the image directory
         self.AB_paths = sorted(make_dataset(self.dir_AB, opt.max_dataset_size))  # get image paths
+        self.AB_paths, self.sample_weights = foreground_index.filter_paths(opt, self.AB_paths)  # skip or down-weight empty slices
         assert(self.opt.load_size >= self.opt.crop_size)   # crop_size should be smaller than the size of loaded image
         self.input_nc = self.opt.output_nc if self.opt.direction == 'BtoA' else self.opt.input_nc
         self.output_nc = self.opt.input_nc if self.opt.direction == 'BtoA' else self.opt.output_nc
+        self.grayscale = self.input_nc == 1 and self.output_nc == 1  # decode straight to a single channel
 
     def __getitem__(self, index):
         """Return a data point and its metadata information.
@@ -38,7 +46,7 @@ class AlignedDataset(BaseDataset):
         """
         # read a image given a random integer index
         AB_path = self.AB_paths[index]
-        AB = Image.open(AB_path).convert('RGB')
+        AB = Image.open(AB_path).convert('L' if self.grayscale else 'RGB')
         # split AB image into A and B
         w, h = AB.size
         w2 = int(w / 2)
@@ -47,8 +55,8 @@ class AlignedDataset(BaseDataset):
 
         # apply the same transform to both A and B
         transform_params = get_params(self.opt, A.size)
-        A_transform = get_transform(self.opt, transform_params, grayscale=(self.input_nc == 1))
-        B_transform = get_transform(self.opt, transform_params, grayscale=(self.output_nc == 1))
+        A_transform = get_transform(self.opt, transform_params, grayscale=(self.input_nc == 1), uint8=self.opt.collate_uint8)
+        B_transform = get_transform(self.opt, transform_params, grayscale=(self.output_nc == 1), uint8=self.opt.collate_uint8)
 
         A = A_transform(A)
         B = B_transform(B)
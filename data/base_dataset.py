@@ -4,6 +4,7 @@ It also includes common transformation functions (e.g., get_transform, __scale_w
 """
 import random
 import numpy as np
+import torch
 import torch.utils.data as data
 from PIL import Image
 import torchvision.transforms as transforms
@@ -86,10 +87,10 @@ def get_params(opt, size):
     return {'crop_pos': (x, y), 'flip': flip, 'rotation': rotation}
 
 
-def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, convert=True):
+def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, convert=True, uint8=False):
     transform_list = []
     if grayscale:
-        transform_list.append(transforms.Grayscale(1))
+        transform_list.append(transforms.Lambda(lambda img: __grayscale(img)))
     if 'resize' in opt.preprocess:
         osize = [opt.load_size, opt.load_size]
         transform_list.append(transforms.Resize(osize, method))
@@ -115,7 +116,9 @@ def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, conve
         elif params['flip']:
             transform_list.append(transforms.Lambda(lambda img: __flip(img, params['flip'])))
 
-    if convert:
+    if convert and uint8:  # keep 8-bit values; the model normalizes them on the device (see <BaseModel.image_to_device>)
+        transform_list += [transforms.Lambda(lambda img: __to_uint8_tensor(img))]
+    elif convert:
         transform_list += [transforms.ToTensor()]
         if grayscale:
             transform_list += [transforms.Normalize((0.5,), (0.5,))]
@@ -124,6 +127,21 @@ def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, conve
     return transforms.Compose(transform_list)
 
 
+def __grayscale(img):
+    """Convert an image to a single channel; images decoded in 'L' mode are returned as they are"""
+    if img.mode == 'L':
+        return img
+    return img.convert('L')
+
+
+def __to_uint8_tensor(img):
+    """Convert a PIL image to a uint8 tensor [C, H, W] without scaling"""
+    image_numpy = np.array(img, np.uint8, copy=True)
+    if image_numpy.ndim == 2:
+        return torch.from_numpy(image_numpy).unsqueeze(0)
+    return torch.from_numpy(image_numpy.transpose((2, 0, 1))).contiguous()
+
+
 def __make_power_2(img, base, method=Image.BICUBIC):
     ow, oh = img.size
     h = int(round(oh / base) * base)
@@ -0,0 +1,79 @@
+"""Foreground index for paired brain slices.
+
+Many exported brain slices are almost entirely black (outside the skull or without tumour). The index records, for every
+{A,B} image pair of a dataset split, the fraction of non-zero pixels and the bounding box of the non-zero content
+(the union over A and B). It is built offline by scan_foreground.py and saved as '<dataroot>/<phase>_foreground.csv'.
+The aligned and brain datasets use it to skip slices below '--min_foreground' or to down-weight them in sampling.
+"""
+import os
+import csv
+import numpy as np
+from PIL import Image
+
+
+FIELDS = ['filename', 'fraction', 'x0', 'y0', 'x1', 'y1']
+
+
+def index_path(dataroot, phase):
+    """Return the path of the foreground index of split <phase>"""
+    return os.path.join(dataroot, '%s_foreground.csv' % phase)
+
+
+def scan_pair(AB_path):
+    """Return the non-zero pixel fraction and the bounding box (x0, y0, x1, y1) of an {A,B} image pair.
+
+    The box is in the coordinates of a single half (A or B), with exclusive x1/y1; it is (-1, -1, -1, -1) for an empty pair.
+    """
+    AB = np.asarray(Image.open(AB_path).convert('L'))
+    w2 = AB.shape[1] // 2
+    mask = (AB[:, :w2] > 0) | (AB[:, w2:2 * w2] > 0)
+    fraction = float(mask.mean())
+    rows, cols = np.flatnonzero(mask.any(1)), np.flatnonzero(mask.any(0))
+    if len(rows) == 0:
+        return fraction, (-1, -1, -1, -1)
+    return fraction, (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def write_index(paths, filename):
+    """Scan every image pair in <paths> and write the foreground index to <filename>"""
+    with open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        for i, path in enumerate(paths):
+            fraction, box = scan_pair(path)
+            writer.writerow([os.path.basename(path), '%.6f' % fraction] + list(box))
+            if i % 1000 == 0:
+                print('scanning (%05d)-th image... %s' % (i, path))
+
+
+def read_index(filename):
+    """Return the foreground index as a dict: image file name -> (fraction, (x0, y0, x1, y1))"""
+    index = {}
+    with open(filename) as f:
+        for row in csv.DictReader(f):
+            index[row['filename']] = (float(row['fraction']), tuple(int(row[k]) for k in FIELDS[2:]))
+    return index
+
+
+def modify_commandline_options(parser):
+    """Add the foreground filtering options to a dataset parser"""
+    parser.add_argument('--min_foreground', type=float, default=0.0, help='slices whose fraction of non-zero pixels is below this value are skipped or down-weighted; needs the index built by scan_foreground.py')
+    parser.add_argument('--foreground_weight', type=float, default=0.0, help='sampling weight of the slices below --min_foreground (relative to 1 for the others); 0 removes them from the dataset')
+    return parser
+
+
+def filter_paths(opt, paths):
+    """Apply the foreground filter of <opt> to a sorted list of image pair paths.
+
+    Returns the kept paths and their sampling weights (None if every kept slice has weight 1).
+    """
+    if getattr(opt, 'min_foreground', 0) <= 0:  # also covers datasets built with another dataset_mode's options
+        return paths, None
+    filename = index_path(opt.dataroot, opt.phase)
+    assert os.path.exists(filename), 'foreground index %s not found; build it with scan_foreground.py' % filename
+    index = read_index(filename)
+    is_foreground = [index[os.path.basename(path)][0] >= opt.min_foreground for path in paths]
+    print('foreground filter: %d of %d slices have a non-zero fraction >= %g' % (sum(is_foreground), len(paths), opt.min_foreground))
+    if opt.foreground_weight <= 0:
+        return [path for path, keep in zip(paths, is_foreground) if keep], None
+    return paths, [1.0 if keep else opt.foreground_weight for keep in is_foreground]
@@ -0,0 +1,45 @@
+import torch
+from data.base_dataset import BaseDataset
+from util.latent_cache import load_latent_cache
+
+
+class LatentDataset(BaseDataset):
+    """A dataset class for precomputed autoencoder latent vectors of brain slice diff maps.
+
+    It is used with '--model time_predictor --netD time_autoenc'. No images are decoded: the latent vectors and time periods
+    are read from the cache built by util/latent_cache.py (see precompute_latents.py), which is rebuilt automatically
+    when it is missing or the autoencoder checkpoint has changed.
+    Since the vectors are tiny, large batches (e.g. '--batch_size 1024') can be used.
+    """
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        BaseDataset.__init__(self, opt)
+        cache = load_latent_cache(opt)
+        n = min(len(cache['time_period']), opt.max_dataset_size)
+        self.latents = torch.from_numpy(cache['latent'][:n])
+        self.time_periods = cache['time_period'][:n].tolist()
+        self.paths = cache['paths'][:n].tolist()
+
+    def __getitem__(self, index):
+        """Return a data point and its metadata information.
+
+        Parameters:
+            index - - a random integer for data indexing
+
+        Returns a dictionary that contains latent, time_period, A_paths and B_paths
+            latent (tensor) - - the autoencoder latent vector of the diff map between A and B
+            time_period (int) - - the time period in weeks between A and B
+            A_paths (str) - - image paths
+            B_paths (str) - - image paths (same as A_paths)
+        """
+        path = self.paths[index]
+        return {'latent': self.latents[index], 'time_period': self.time_periods[index], 'A_paths': path, 'B_paths': path}
+
+    def __len__(self):
+        """Return the total number of latent vectors in the dataset."""
+        return len(self.paths)
@@ -24,6 +24,7 @@ class AutoEncoderModel(BaseModel):
         """
         # changing the default values to match the pix2pix paper (https://phillipi.github.io/pix2pix/)
         parser.set_defaults(norm='batch', dataset_mode='aligned')
+        parser.add_argument('--netAE', type=str, default='autoenc', help='autoencoder architecture [autoenc | autoenc_conv]. autoenc_conv has a convolutional bottleneck and works at any multiple of 16 px')
         return parser
 
     def __init__(self, opt):
@@ -40,14 +41,14 @@ class AutoEncoderModel(BaseModel):
         # specify the models you want to save to the disk. The training/test scripts will call <BaseModel.save_networks> and <BaseModel.load_networks>
         self.model_names = ['AE']
         # define network
-        self.netAE = networks.define_D(opt.input_nc, opt.ndf, 'autoenc',
+        self.netAE = networks.define_D(opt.input_nc, opt.ndf, opt.netAE,
                                           opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
 
         if self.isTrain:
             # define loss functions
             self.criterionL1 = torch.nn.L1Loss()
             # initialize optimizers; schedulers will be automatically created by function <BaseModel.setup>.
-            self.optimizer_AE = torch.optim.Adam(self.netAE.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
+            self.optimizer_AE = self.create_adam(self.netAE.parameters())
             self.optimizers.append(self.optimizer_AE)
 
     def set_input(self, input):
@@ -59,9 +60,9 @@ class AutoEncoderModel(BaseModel):
         The option 'direction' can be used to swap images in domain A and domain B.
         """
         AtoB = self.opt.direction == 'AtoB'
-        self.real_A = input['A' if AtoB else 'B'].to(self.device)
-        self.real_B = input['B' if AtoB else 'A'].to(self.device)
-        self.diff_map = input['diff_map'].to(self.device)
+        self.real_A = self.image_to_device(input['A' if AtoB else 'B'])
+        self.real_B = self.image_to_device(input['B' if AtoB else 'A'])
+        self.diff_map = self.image_to_device(input['diff_map'])
         self.hist_diff = input['hist_diff'].float().to(self.device)
         self.image_paths = input['A_paths' if AtoB else 'B_paths']
 
@@ -75,16 +76,20 @@ class AutoEncoderModel(BaseModel):
             latent_vector = self.netAE.forward_vectorOnly(self.diff_map)
         return latent_vector
 
+    def validation_metric(self):
+        """Return the L1 reconstruction error of each sample's diff map"""
+        return (self.recreated_diff_map.float() - self.diff_map.float()).abs().flatten(1).mean(1)
+
     def backward_AE(self):
         # Calculate Loss for AE
         self.loss_AE_real = self.criterionL1(self.diff_map, self.recreated_diff_map)
         self.loss_AE = self.loss_AE_real
-        self.loss_AE.backward()
+        self.backward_loss(self.loss_AE)
 
     def optimize_parameters(self):
         self.forward()
         # update AE
         self.set_requires_grad(self.netAE, True)  # enable backprop for AE
-        self.optimizer_AE.zero_grad()     # set AE's gradients to zero
+        self.zero_grad(self.optimizer_AE)     # set AE's gradients to zero
         self.backward_AE()                # calculate gradients for AE
-        self.optimizer_AE.step()          # update AE's weights
+        self.step_optimizer(self.optimizer_AE)  # update AE's weights
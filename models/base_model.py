@@ -1,4 +1,6 @@
 import os
+import contextlib
+import inspect
 import torch
 from collections import OrderedDict
 from abc import ABC, abstractmethod
@@ -41,7 +43,27 @@ class BaseModel(ABC):
         self.visual_names = []
         self.optimizers = []
         self.image_paths = []
-        self.metric = 0  # used for learning rate policy 'plateau'
+        self.metric = None  # validation metric for learning rate policy 'plateau'; None until the next validation
+        self.gp_steps = {}  # D updates seen by <gradient_penalty>, per discriminator
+        self.grad_switches = {}  # network -> [parameter list, requires_grad flag]; see <set_requires_grad>
+        self.compile_stats = {}  # compilations and failures of the callables compiled by <compile_step>
+        # gradient accumulation ('--accum_steps'): position of the current micro-batch in the accumulation window
+        self.accum_steps = max(getattr(opt, 'accum_steps', 1), 1)
+        self.micro_step = 0
+        self.stepped = set()  # optimizers stepped since the last update of the gradient scaler
+        # whether this PyTorch version's optimizers can clear gradients by setting them to None (see <zero_grad>)
+        self.set_to_none = 'set_to_none' in inspect.signature(torch.optim.Optimizer.zero_grad).parameters
+        # mixed precision ('--amp'): bfloat16 autocast on the CPU; float16 autocast with gradient scaling on a GPU
+        self.amp_dtype = None
+        self.scaler = None
+        if opt.amp:
+            if not hasattr(torch, 'autocast'):
+                print('torch.autocast is not supported by this PyTorch version; running in float32')
+            elif self.device.type == 'cuda':
+                self.amp_dtype = torch.float16
+                self.scaler = torch.cuda.amp.GradScaler() if self.isTrain else None
+            else:
+                self.amp_dtype = torch.bfloat16
 
     @staticmethod
     def modify_commandline_options(parser, is_train):
@@ -65,6 +87,14 @@ class BaseModel(ABC):
         """
         pass
 
+    def image_to_device(self, image):
+        """Move an image batch to the device. Batches collated as uint8 ('--collate_uint8') are scaled to [-1, 1] there,
+        as ToTensor and Normalize((0.5,), (0.5,)) would have done on the host."""
+        image = image.to(self.device)
+        if image.dtype == torch.uint8:
+            image = image.float().div_(127.5).sub_(1.0)
+        return image
+
     @abstractmethod
     def forward(self):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
@@ -75,6 +105,134 @@ class BaseModel(ABC):
         """Calculate losses, gradients, and update network weights; called in every training iteration"""
         pass
 
+    def autocast(self):
+        """Return a context that runs the enclosed forward passes and losses in mixed precision if '--amp' is set.
+
+        <train_step> runs <optimize_parameters> under it, so every model trains in mixed precision without wrapping its
+        own code; <backward_loss> and <step_optimizer> leave it for the backward pass and the update.
+        """
+        if self.amp_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(self.device.type, dtype=self.amp_dtype)
+
+    def compile_step(self, names):
+        """Compile the forward passes of the networks net<names> and the GAN loss of the training step ('--compile')
+
+        Each callable falls back to eager execution if it cannot be compiled without graph breaks; compile times and
+        retracing are printed and kept in self.compile_stats (see <networks.compile_fn>). The backward passes and the
+        optimizer updates stay eager. The forward method is patched on the network itself, which the replicas of
+        nn.DataParallel would not pick up, so compiling needs a single device.
+        """
+        assert len(self.gpu_ids) <= 1, '--compile runs on a single device; it does not support several --gpu_ids'
+        for name in names:
+            networks.compile_net(getattr(self, 'net' + name), 'net' + name, self.compile_stats)
+        if hasattr(self, 'criterionGAN'):
+            self.criterionGAN = networks.compile_fn(self.criterionGAN.__call__, 'criterionGAN', self.compile_stats)
+
+    def create_adam(self, params):
+        """Return an Adam optimizer for <params> with the learning rate and betas from the options.
+
+        '--adam_impl' selects the implementation: [fused] runs one kernel for all the parameters, [foreach] uses
+        multi-tensor operations, and [for_loop] updates the parameters one by one. [auto] picks fused on a GPU and
+        foreach on the CPU. If this PyTorch version or device does not support the choice, we fall back to foreach
+        and then to the default implementation.
+        """
+        params = list(params)
+        kwargs = {'lr': self.opt.lr, 'betas': (self.opt.beta1, 0.999)}
+        impl = getattr(self.opt, 'adam_impl', 'auto')
+        if impl == 'auto':
+            impl = 'fused' if self.device.type == 'cuda' else 'foreach'
+        supported = inspect.signature(torch.optim.Adam.__init__).parameters
+        if impl == 'for_loop':
+            return torch.optim.Adam(params, foreach=False, **kwargs) if 'foreach' in supported else torch.optim.Adam(params, **kwargs)
+        for name in [impl, 'foreach']:
+            if name in supported:
+                try:
+                    return torch.optim.Adam(params, **dict(kwargs, **{name: True}))
+                except (RuntimeError, ValueError) as error:  # e.g. fused Adam on a device without a fused kernel
+                    print('Adam(%s=True) is not available (%s); falling back' % (name, error))
+        return torch.optim.Adam(params, **kwargs)
+
+    def train_step(self):
+        """Run <optimize_parameters> on the current (micro-)batch; called by train.py in every training iteration.
+
+        With '--accum_steps N', the gradients of N consecutive micro-batches are accumulated: <zero_grad> only clears
+        them on the first micro-batch, <backward_loss> divides each loss by N, and <step_optimizer> only updates the
+        weights on the last micro-batch. The networks updated second must see the same first network in every
+        micro-batch: cycle_gan steps G, then D on fakes made before the G update. pix2pix and pix2pix_brain step D
+        after the last <backward_G> of the window (rather than before it, as with N = 1), so all of G's accumulated
+        gradients come from the D of the previous window.
+        The step runs under <autocast> (mixed precision with '--amp').
+        """
+        with self.autocast():
+            self.optimize_parameters()
+        self.micro_step = (self.micro_step + 1) % self.accum_steps
+
+    def zero_grad(self, optimizer):
+        """Clear the gradients of <optimizer> by setting them to None (when supported) instead of filling them with zeros
+
+        With '--accum_steps', only the first micro-batch of each accumulation window clears them.
+        """
+        if self.micro_step != 0:
+            return
+        if self.set_to_none:
+            optimizer.zero_grad(set_to_none=True)
+        else:
+            optimizer.zero_grad()
+
+    def backward_loss(self, loss):
+        """Calculate the gradients of <loss>, scaling it first when training in float16 (and by 1 / '--accum_steps')"""
+        if self.accum_steps > 1:
+            loss = loss / self.accum_steps
+        with networks.autocast_disabled(self.device):
+            if self.scaler is not None:
+                self.scaler.scale(loss).backward()
+            else:
+                loss.backward()
+
+    def step_optimizer(self, optimizer):
+        """Update the weights of <optimizer>; in float16, skip the update if the scaled gradients overflowed
+
+        With '--accum_steps', only the last micro-batch of each accumulation window updates the weights. The loss scale
+        is updated once all the optimizers have stepped, so all the gradients of a window share the same scale.
+        """
+        if self.micro_step != self.accum_steps - 1:
+            return
+        with networks.autocast_disabled(self.device):
+            if self.scaler is not None:
+                self.scaler.step(optimizer)
+                self.stepped.add(optimizer)
+                if len(self.stepped) >= len(self.optimizers):
+                    self.scaler.update()
+                    self.stepped.clear()
+            else:
+                optimizer.step()
+
+    def gradient_penalty(self, name, real, fake):
+        """Return the gradient penalty of discriminator net<name> on <real> and <fake> images, to be added to its loss.
+
+        '--gp_type wgangp' penalizes (||grad D|| - 1)^2 at random interpolations of real and fake; '--gp_type r1'
+        penalizes ||grad D(real)||^2 / 2. Both need a double backward pass, so with '--gp_every k' the penalty is only
+        computed on every k-th call for this D, with its weight multiplied by k (lazy regularization, StyleGAN2
+        https://arxiv.org/abs/1912.04958); other calls return 0.
+        """
+        lambda_gp = getattr(self.opt, 'lambda_gp', 0.0)
+        if lambda_gp <= 0.0:
+            return 0.0
+        every = max(self.opt.gp_every, 1)
+        step = self.gp_steps.get(name, 0)
+        self.gp_steps[name] = step + 1
+        if step % every != 0:
+            return 0.0
+        netD = getattr(self, 'net' + name)
+        if self.opt.gp_type == 'r1':
+            penalty, _ = networks.cal_gradient_penalty(netD, real, fake, self.device, type='real', constant=0.0, lambda_gp=0.5 * lambda_gp * every)
+        elif self.opt.gp_type == 'wgangp':
+            penalty, _ = networks.cal_gradient_penalty(netD, real, fake, self.device, type='mixed', constant=1.0, lambda_gp=lambda_gp * every)
+        else:
+            raise NotImplementedError('gradient penalty [%s] is not implemented' % self.opt.gp_type)
+        return penalty
+
     def setup(self, opt):
         """Load and print networks; create schedulers
 
@@ -95,31 +253,109 @@ class BaseModel(ABC):
                 net = getattr(self, 'net' + name)
                 net.eval()
 
+    def train(self):
+        """Make models train mode again, e.g. after an evaluation pass in eval mode"""
+        for name in self.model_names:
+            if isinstance(name, str):
+                net = getattr(self, 'net' + name)
+                net.train()
+
     def test(self):
         """Forward function used in test time.
 
         This function wraps <forward> function in no_grad() so we don't save intermediate steps for backprop
         It also calls <compute_visuals> to produce additional visualization results
         """
-        with torch.no_grad():
+        with torch.no_grad(), self.autocast():
             self.forward()
             self.compute_visuals()
 
+    def validation_metric(self):
+        """Return the validation error of each sample of the current batch (shape [N], lower is better); called after <forward>
+
+        By default, the mean L1 distance between fake_B and real_B. Models without these images, or whose domains are
+        not aligned, override it.
+        """
+        return (self.fake_B.float() - self.real_B.float()).abs().flatten(1).mean(1)
+
+    def validate(self, dataset, num_samples):
+        """Return the mean <validation_metric> over the first <num_samples> samples of <dataset> ('--val_phase')
+
+        The networks run in eval mode under torch.no_grad and are put back in train mode afterwards.
+        The errors are accumulated on the model device, so there is a single host sync at the end.
+        """
+        self.eval()
+        error = torch.zeros((), device=self.device)
+        count = 0
+        with torch.no_grad(), self.autocast():
+            for data in dataset:
+                if count >= num_samples:
+                    break
+                self.set_input(data)
+                self.forward()
+                errors = self.validation_metric()[:num_samples - count]
+                error += errors.float().sum()
+                count += len(errors)
+        self.train()
+        return error.item() / max(count, 1)
+
     def compute_visuals(self):
         """Calculate additional output images for visdom and HTML visualization"""
         pass
 
+    def release_step(self, keep_visuals=False):
+        """Drop the references to the last training step ('--lean_step'); called by train.py after <train_step>
+
+        Parameters:
+            keep_visuals (bool) -- whether the visualizer will use the visuals of this step
+
+        The output images (fake_B, rec_A, idt_A, ...) and the losses keep their tensors and autograd history alive
+        until the next step overwrites them, which adds to the peak memory of that step. Scalar tensors (the losses)
+        are detached and the other tensors with a history are dropped (set to None). With <keep_visuals>, we first run
+        <compute_visuals>, and replace every visual by a detached copy downsampled to at most '--display_winsize'.
+        Auxiliary models held as attributes (e.g. the TPN of pix2pix_brain, which keeps fake_B and its prediction)
+        are released too, without visuals.
+        """
+        if keep_visuals:
+            self.compute_visuals()
+        for name, value in list(vars(self).items()):
+            if isinstance(value, BaseModel):
+                value.release_step()
+                continue
+            if not torch.is_tensor(value):
+                continue
+            if keep_visuals and name in self.visual_names:
+                setattr(self, name, self.thumbnail(value))
+            elif value.grad_fn is not None:
+                setattr(self, name, value.detach() if value.numel() == 1 else None)
+
+    def thumbnail(self, image):
+        """Return a detached copy of an image batch, downsampled (by area averaging) to at most '--display_winsize' pixels"""
+        image = image.detach()
+        size = self.opt.display_winsize
+        if image.dim() != 4 or max(image.shape[2:]) <= size:
+            return image.clone()
+        scale = float(size) / max(image.shape[2:])
+        shape = (max(1, int(round(image.shape[2] * scale))), max(1, int(round(image.shape[3] * scale))))
+        return torch.nn.functional.interpolate(image.float(), size=shape, mode='area').to(image.dtype)
+
     def get_image_paths(self):
         """ Return image paths that are used to load current data"""
         return self.image_paths
 
     def update_learning_rate(self):
-        """Update learning rates for all the networks; called at the end of every epoch"""
+        """Update learning rates for all the networks; called at the end of every epoch
+
+        The 'plateau' policy only steps on a new <metric> (set by train.py after a validation) and consumes it, so its
+        patience counts validations rather than epochs.
+        """
         for scheduler in self.schedulers:
             if self.opt.lr_policy == 'plateau':
-                scheduler.step(self.metric)
+                if self.metric is not None:
+                    scheduler.step(self.metric)
             else:
                 scheduler.step()
+        self.metric = None
 
         lr = self.optimizers[0].param_groups[0]['lr']
         print('learning rate = %.7f' % lr)
@@ -220,10 +456,18 @@ class BaseModel(ABC):
         Parameters:
             nets (network list)   -- a list of networks
             requires_grad (bool)  -- whether the networks require gradients or not
+        The parameter list of each network is cached, and networks already in the requested state are skipped, so
+        the flags must only be changed through this function.
         """
         if not isinstance(nets, list):
             nets = [nets]
         for net in nets:
             if net is not None:
-                for param in net.parameters():
+                if net not in self.grad_switches:
+                    self.grad_switches[net] = [list(net.parameters()), None]
+                switch = self.grad_switches[net]
+                if switch[1] == requires_grad:
+                    continue
+                for param in switch[0]:
                     param.requires_grad = requires_grad
+                switch[1] = requires_grad
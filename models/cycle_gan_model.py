@@ -1,5 +1,6 @@
 import torch
 import itertools
+import threading
 from util.image_pool import ImagePool
 from .base_model import BaseModel
 from . import networks
@@ -35,12 +36,16 @@ class CycleGANModel(BaseModel):
         Backward cycle loss: lambda_B * ||G_A(G_B(B)) - B|| (Eqn. (2) in the paper)
         Identity loss (optional): lambda_identity * (||G_A(B) - B|| * lambda_B + ||G_B(A) - A|| * lambda_A) (Sec 5.2 "Photo generation from paintings" in the paper)
         Dropout is not used in the original CycleGAN paper.
+        With '--fused_batch', G_A runs on [A, B] and G_B on [B, A] in one call each (fake and identity images together),
+        and each D runs once on [real, fake]. This gives the same losses as long as the normalization is per sample.
         """
         parser.set_defaults(no_dropout=True)  # default CycleGAN did not use dropout
         if is_train:
             parser.add_argument('--lambda_A', type=float, default=10.0, help='weight for cycle loss (A -> B -> A)')
             parser.add_argument('--lambda_B', type=float, default=10.0, help='weight for cycle loss (B -> A -> B)')
             parser.add_argument('--lambda_identity', type=float, default=0.5, help='use identity mapping. Setting lambda_identity other than 0 has an effect of scaling the weight of the identity mapping loss. For example, if the weight of the identity loss should be 10 times smaller than the weight of the reconstruction loss, please set lambda_identity = 0.1')
+            parser.add_argument('--fork_branches', action='store_true', help='run the A -> B -> A and B -> A -> B generator branches, and the D_A and D_B updates, concurrently on two Python threads; for many-core CPUs. Each branch uses --intra_threads intra-op threads, so set about half of the cores. Not with --fused_batch, --norm batch or --compile')
+            parser.add_argument('--fused_batch', action='store_true', help='concatenate the images along the batch dimension so that each G runs once for its fake and identity images, and each D once for real and fake. Needs per-sample normalization [instance | none]')
 
         return parser
 
@@ -53,6 +58,8 @@ class CycleGANModel(BaseModel):
         BaseModel.__init__(self, opt)
         # specify the training losses you want to print out. The training/test scripts will call <BaseModel.get_current_losses>
         self.loss_names = ['D_A', 'G_A', 'cycle_A', 'idt_A', 'D_B', 'G_B', 'cycle_B', 'idt_B']
+        if self.isTrain and opt.lambda_gp > 0.0:
+            self.loss_names += ['GP_A', 'GP_B']
         # specify the images you want to save/display. The training/test scripts will call <BaseModel.get_current_visuals>
         visual_names_A = ['real_A', 'fake_B', 'rec_A']
         visual_names_B = ['real_B', 'fake_A', 'rec_B']
@@ -74,6 +81,8 @@ class CycleGANModel(BaseModel):
                                         not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids)
         self.netG_B = networks.define_G(opt.output_nc, opt.input_nc, opt.ngf, opt.netG, opt.norm,
                                         not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids)
+        if self.isTrain and opt.checkpoint_G > 0:  # recompute generator activations in the backward pass
+            networks.set_checkpointing([self.netG_A, self.netG_B], opt.checkpoint_G)
 
         if self.isTrain:  # define discriminators
             self.netD_A = networks.define_D(opt.output_nc, opt.ndf, opt.netD,
@@ -81,20 +90,39 @@ class CycleGANModel(BaseModel):
             self.netD_B = networks.define_D(opt.input_nc, opt.ndf, opt.netD,
                                             opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
 
+        self.fused_batch = self.isTrain and opt.fused_batch
+        self.fork_branches = self.isTrain and opt.fork_branches
         if self.isTrain:
+            if self.fork_branches:  # the branches share G_A and G_B, and dynamo tracing is not thread-safe
+                assert not self.fused_batch, '--fork_branches and --fused_batch are mutually exclusive'
+                assert opt.norm != 'batch', '--fork_branches would update the BatchNorm statistics from two threads: use --norm instance or none'
+                assert not opt.compile, '--fork_branches and --compile are mutually exclusive'
             if opt.lambda_identity > 0.0:  # only works when input and output images have the same number of channels
                 assert(opt.input_nc == opt.output_nc)
-            self.fake_A_pool = ImagePool(opt.pool_size)  # create image buffer to store previously generated images
-            self.fake_B_pool = ImagePool(opt.pool_size)  # create image buffer to store previously generated images
+            if self.fused_batch:  # batch statistics would mix the fused images
+                assert opt.norm != 'batch', '--fused_batch needs per-sample normalization: use --norm instance or none'
+            pin_memory = opt.pool_on_host and self.device.type == 'cuda'
+            self.fake_A_pool = ImagePool(opt.pool_size, self.pool_generator(pin_memory, 0), pin_memory)  # create image buffer to store previously generated images
+            self.fake_B_pool = ImagePool(opt.pool_size, self.pool_generator(pin_memory, 1), pin_memory)  # create image buffer to store previously generated images
             # define loss functions
             self.criterionGAN = networks.GANLoss(opt.gan_mode).to(self.device)  # define GAN loss.
             self.criterionCycle = torch.nn.L1Loss()
             self.criterionIdt = torch.nn.L1Loss()
             # initialize optimizers; schedulers will be automatically created by function <BaseModel.setup>.
-            self.optimizer_G = torch.optim.Adam(itertools.chain(self.netG_A.parameters(), self.netG_B.parameters()), lr=opt.lr, betas=(opt.beta1, 0.999))
-            self.optimizer_D = torch.optim.Adam(itertools.chain(self.netD_A.parameters(), self.netD_B.parameters()), lr=opt.lr, betas=(opt.beta1, 0.999))
+            self.optimizer_G = self.create_adam(itertools.chain(self.netG_A.parameters(), self.netG_B.parameters()))
+            self.optimizer_D = self.create_adam(itertools.chain(self.netD_A.parameters(), self.netD_B.parameters()))
             self.optimizers.append(self.optimizer_G)
             self.optimizers.append(self.optimizer_D)
+            if opt.compile:
+                self.compile_step(self.model_names)
+
+    def pool_generator(self, on_host, offset):
+        """Return the random generator of an image pool stored on the host or on self.device, seeded with
+        '--pool_seed' + <offset>; None (the global generator) if '--pool_seed' is -1"""
+        if self.opt.pool_seed < 0:
+            return None
+        generator = torch.Generator() if on_host else torch.Generator(device=self.device)
+        return generator.manual_seed(self.opt.pool_seed + offset)
 
     def set_input(self, input):
         """Unpack input data from the dataloader and perform necessary pre-processing steps.
@@ -111,42 +139,104 @@ class CycleGANModel(BaseModel):
 
     def forward(self):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
+        if self.fused_batch and self.opt.lambda_identity > 0.0:
+            self.forward_fused()
+            return
+        if self.fork_branches:  # the two branches only meet in the loss
+            wait = self.fork(self.forward_A)
+            self.forward_B()
+            wait()
+            return
+        self.forward_A()
+        self.forward_B()
+
+    def forward_A(self):
+        """Run the A -> B -> A branch of <forward>"""
         self.fake_B = self.netG_A(self.real_A)  # G_A(A)
         self.rec_A = self.netG_B(self.fake_B)   # G_B(G_A(A))
+
+    def forward_B(self):
+        """Run the B -> A -> B branch of <forward>"""
         self.fake_A = self.netG_B(self.real_B)  # G_B(B)
         self.rec_B = self.netG_A(self.fake_A)   # G_A(G_B(B))
 
-    def backward_D_basic(self, netD, real, fake):
+    def validation_metric(self):
+        """Return the cycle-consistency L1 error of each sample, averaged over both directions (A and B are unaligned)"""
+        error_A = (self.rec_A.float() - self.real_A.float()).abs().flatten(1).mean(1)
+        error_B = (self.rec_B.float() - self.real_B.float()).abs().flatten(1).mean(1)
+        return (error_A + error_B) / 2
+
+    def fork(self, fn):
+        """Start <fn> on a new thread and return a function that waits for it ('--fork_branches').
+
+        PyTorch operators release the GIL, so <fn> overlaps with the caller's work; the thread ends with <fn>, so
+        nothing outlives the step. Grad mode and autocast are thread-local, so the thread sets the caller's grad mode
+        and the mixed precision of <train_step> again. An exception raised by <fn> is raised again by the wait.
+        """
+        grad_enabled = torch.is_grad_enabled()
+        errors = []
+
+        def run():
+            try:
+                with torch.set_grad_enabled(grad_enabled), self.autocast():
+                    fn()
+            except BaseException as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+
+        def wait():
+            thread.join()
+            if errors:
+                raise errors[0]
+        return wait
+
+    def forward_fused(self):
+        """Run forward pass with '--fused_batch'; also computes the identity images idt_A and idt_B used by <backward_G>."""
+        sizes = [self.real_A.size(0), self.real_B.size(0)]
+        self.fake_B, self.idt_A = torch.split(self.netG_A(torch.cat((self.real_A, self.real_B), 0)), sizes)  # G_A(A), G_A(B)
+        self.fake_A, self.idt_B = torch.split(self.netG_B(torch.cat((self.real_B, self.real_A), 0)), sizes[::-1])  # G_B(B), G_B(A)
+        self.rec_A = self.netG_B(self.fake_B)   # G_B(G_A(A))
+        self.rec_B = self.netG_A(self.fake_A)   # G_A(G_B(B))
+
+    def backward_D_basic(self, netD, real, fake, penalty=0.0):
         """Calculate GAN loss for the discriminator
 
         Parameters:
             netD (network)      -- the discriminator D
             real (tensor array) -- real images
             fake (tensor array) -- images generated by a generator
+            penalty             -- gradient penalty added to the loss (see <BaseModel.gradient_penalty>)
 
         Return the discriminator loss.
-        We also call loss_D.backward() to calculate the gradients.
+        We also call <backward_loss> on loss_D to calculate the gradients.
         """
+        if self.fused_batch:  # real and fake in one call
+            pred_real, pred_fake = torch.split(netD(torch.cat((real, fake.detach()), 0)), [real.size(0), fake.size(0)])
+        else:
+            pred_real = netD(real)
+            pred_fake = netD(fake.detach())
         # Real
-        pred_real = netD(real)
         loss_D_real = self.criterionGAN(pred_real, True)
         # Fake
-        pred_fake = netD(fake.detach())
         loss_D_fake = self.criterionGAN(pred_fake, False)
         # Combined loss and calculate gradients
-        loss_D = (loss_D_real + loss_D_fake) * 0.5
-        loss_D.backward()
+        loss_D = (loss_D_real + loss_D_fake) * 0.5 + penalty
+        self.backward_loss(loss_D)
         return loss_D
 
     def backward_D_A(self):
         """Calculate GAN loss for discriminator D_A"""
         fake_B = self.fake_B_pool.query(self.fake_B)
-        self.loss_D_A = self.backward_D_basic(self.netD_A, self.real_B, fake_B)
+        self.loss_GP_A = self.gradient_penalty('D_A', self.real_B, fake_B)
+        self.loss_D_A = self.backward_D_basic(self.netD_A, self.real_B, fake_B, self.loss_GP_A)
 
     def backward_D_B(self):
         """Calculate GAN loss for discriminator D_B"""
         fake_A = self.fake_A_pool.query(self.fake_A)
-        self.loss_D_B = self.backward_D_basic(self.netD_B, self.real_A, fake_A)
+        self.loss_GP_B = self.gradient_penalty('D_B', self.real_A, fake_A)
+        self.loss_D_B = self.backward_D_basic(self.netD_B, self.real_A, fake_A, self.loss_GP_B)
 
     def backward_G(self):
         """Calculate the loss for generators G_A and G_B"""
@@ -155,11 +245,12 @@ class CycleGANModel(BaseModel):
         lambda_B = self.opt.lambda_B
         # Identity loss
         if lambda_idt > 0:
+            if not self.fused_batch:  # with '--fused_batch', <forward> has computed idt_A and idt_B
+                self.idt_A = self.netG_A(self.real_B)
+                self.idt_B = self.netG_B(self.real_A)
             # G_A should be identity if real_B is fed: ||G_A(B) - B||
-            self.idt_A = self.netG_A(self.real_B)
             self.loss_idt_A = self.criterionIdt(self.idt_A, self.real_B) * lambda_B * lambda_idt
             # G_B should be identity if real_A is fed: ||G_B(A) - A||
-            self.idt_B = self.netG_B(self.real_A)
             self.loss_idt_B = self.criterionIdt(self.idt_B, self.real_A) * lambda_A * lambda_idt
         else:
             self.loss_idt_A = 0
@@ -175,7 +266,7 @@ class CycleGANModel(BaseModel):
         self.loss_cycle_B = self.criterionCycle(self.rec_B, self.real_B) * lambda_B
         # combined loss and calculate gradients
         self.loss_G = self.loss_G_A + self.loss_G_B + self.loss_cycle_A + self.loss_cycle_B + self.loss_idt_A + self.loss_idt_B
-        self.loss_G.backward()
+        self.backward_loss(self.loss_G)
 
     def optimize_parameters(self):
         """Calculate losses, gradients, and update network weights; called in every training iteration"""
@@ -183,12 +274,17 @@ class CycleGANModel(BaseModel):
         self.forward()      # compute fake images and reconstruction images.
         # G_A and G_B
         self.set_requires_grad([self.netD_A, self.netD_B], False)  # Ds require no gradients when optimizing Gs
-        self.optimizer_G.zero_grad()  # set G_A and G_B's gradients to zero
+        self.zero_grad(self.optimizer_G)  # set G_A and G_B's gradients to zero
         self.backward_G()             # calculate gradients for G_A and G_B
-        self.optimizer_G.step()       # update G_A and G_B's weights
+        self.step_optimizer(self.optimizer_G)  # update G_A and G_B's weights
         # D_A and D_B
         self.set_requires_grad([self.netD_A, self.netD_B], True)
-        self.optimizer_D.zero_grad()   # set D_A and D_B's gradients to zero
-        self.backward_D_A()      # calculate gradients for D_A
-        self.backward_D_B()      # calculate graidents for D_B
-        self.optimizer_D.step()  # update D_A and D_B's weights
+        self.zero_grad(self.optimizer_D)   # set D_A and D_B's gradients to zero
+        if self.fork_branches:   # the two D losses are independent
+            wait = self.fork(self.backward_D_A)
+            self.backward_D_B()
+            wait()
+        else:
+            self.backward_D_A()      # calculate gradients for D_A
+            self.backward_D_B()      # calculate graidents for D_B
+        self.step_optimizer(self.optimizer_D)  # update D_A and D_B's weights
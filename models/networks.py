@@ -3,7 +3,11 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.nn import init
 import functools
+import contextlib
+import inspect
+import time
 from torch.optim import lr_scheduler
+from torch.utils.checkpoint import checkpoint as torch_checkpoint
 
 
 ###############################################################################
@@ -118,6 +122,104 @@ def init_net(net, init_type='normal', init_gain=0.02, gpu_ids=[]):
     return net
 
 
+def accelerate_net(net, mode='none'):
+    """Prepare a network for faster execution
+
+    Parameters:
+        net (network) -- the network to be accelerated
+        mode (str)    -- the acceleration method: none | channels_last | compile
+
+    'channels_last' stores the conv weights in NHWC memory format, which is faster for convolutions on recent CPUs and GPUs.
+    'compile' wraps the network with torch.compile. Both fall back to the original network if the PyTorch version lacks the feature.
+    Return the (possibly wrapped) network.
+    """
+    if mode == 'none':
+        return net
+    elif mode == 'channels_last':
+        if not hasattr(torch, 'channels_last'):
+            print('channels_last memory format is not supported by this PyTorch version; keeping the default layout')
+            return net
+        return net.to(memory_format=torch.channels_last)
+    elif mode == 'compile':
+        if not hasattr(torch, 'compile'):
+            print('torch.compile is not supported by this PyTorch version; running eagerly')
+            return net
+        return torch.compile(net)
+    else:
+        raise NotImplementedError('acceleration mode [%s] is not recognized' % mode)
+
+
+def compile_fn(fn, name, stats, guard=None):
+    """Compile the callable <fn> with torch.compile (without graph breaks), falling back to <fn> if that fails
+
+    Parameters:
+        fn (callable)   -- the function to compile, e.g. the forward method of a network
+        name (str)      -- the name used in the reports
+        stats (dict)    -- stats[name] receives the list of compilations as (input signature, seconds) under 'traces', and
+                           the error message under 'failed' if we fell back to eager execution
+        guard (callable)-- returns extra state that torch.compile specializes on (e.g. the requires_grad flags)
+
+    torch.compile traces and compiles <fn> again for each new input signature: tensor shapes, other arguments and the
+    <guard> state. We time the first call with each signature and print it, flagging the ones caused by new tensor
+    shapes (e.g. with '--crop_foreground' or 'scale_width') as retraces. If compilation fails (fullgraph=True turns graph
+    breaks into errors), we print the error and run <fn> eagerly from then on.
+    Return the wrapped callable.
+    """
+    if not hasattr(torch, 'compile'):
+        print('torch.compile is not supported by this PyTorch version; running %s eagerly' % name)
+        return fn
+    compiled = torch.compile(fn, fullgraph=True)
+    record = stats.setdefault(name, {'traces': [], 'failed': None})
+    seen = set()
+
+    def run(*args, **kwargs):
+        if record['failed'] is not None:
+            return fn(*args, **kwargs)
+        values = list(args) + [kwargs[key] for key in sorted(kwargs)]
+        shapes = tuple(tuple(value.shape) for value in values if torch.is_tensor(value))
+        others = (tuple(sorted(kwargs)), tuple(repr(value) for value in values if not torch.is_tensor(value)),
+                  torch.is_grad_enabled(), guard() if guard else None)
+        if (shapes, others) in seen:
+            return compiled(*args, **kwargs)
+        start = time.time()
+        try:
+            out = compiled(*args, **kwargs)
+        except Exception as error:
+            record['failed'] = '%s: %s' % (type(error).__name__, (str(error).splitlines() or [''])[0])
+            print('torch.compile failed for %s (%s); running it eagerly' % (name, record['failed']))
+            return fn(*args, **kwargs)
+        seconds = time.time() - start
+        retrace = any(other == others for _, other in seen)
+        print('%s %s for input shapes %s in %.1f s' % (name, 'retraced' if retrace else 'compiled', shapes, seconds))
+        record['traces'].append(((shapes, others), seconds))
+        seen.add((shapes, others))
+        return out
+    return run
+
+
+def compile_net(net, name, stats):
+    """Compile the forward pass of <net> in place with <compile_fn>
+
+    The forward method is replaced on the module itself (inside DataParallel), so the state_dict keys do not change.
+    Replicas made by DataParallel over several GPUs would still call the original module through that bound method,
+    so <net> must run on a single device (see <BaseModel.compile_step>).
+    """
+    module = net.module if isinstance(net, nn.DataParallel) else net
+    params = list(module.parameters())
+    module.forward = compile_fn(module.forward, name, stats,
+                                guard=lambda: (module.training, params[0].requires_grad if params else None))
+
+
+def autocast_disabled(device):
+    """Return a context in which autocast (mixed precision, see '--amp') is off on <device>
+
+    Numerically sensitive computations (the GAN losses, the gradient penalty) run in float32 inside it.
+    """
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(device.type, enabled=False)
+    return contextlib.nullcontext()
+
+
 def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, init_type='normal', init_gain=0.02, gpu_ids=[]):
     """Create a generator
 
@@ -125,7 +227,7 @@ def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, in
         input_nc (int) -- the number of channels in input images
         output_nc (int) -- the number of channels in output images
         ngf (int) -- the number of filters in the last conv layer
-        netG (str) -- the architecture's name: resnet_9blocks | resnet_6blocks | unet_256 | unet_128
+        netG (str) -- the architecture's name: resnet_9blocks | resnet_6blocks | resnet_9blocks_rev | resnet_6blocks_rev | unet_256 | unet_128
         norm (str) -- the name of normalization layers used in the network: batch | instance | none
         use_dropout (bool) -- if use dropout layers.
         init_type (str)    -- the name of our initialization method.
@@ -141,6 +243,7 @@ def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, in
         Resnet-based generator: [resnet_6blocks] (with 6 Resnet blocks) and [resnet_9blocks] (with 9 Resnet blocks)
         Resnet-based generator consists of several Resnet blocks between a few downsampling/upsampling operations.
         We adapt Torch code from Justin Johnson's neural style transfer project (https://github.com/jcjohnson/fast-neural-style).
+        The [*_rev] variants use reversible blocks, whose activation memory does not grow with the number of blocks.
 
 
     The generator has been initialized by <init_net>. It uses RELU for non-linearity.
@@ -152,6 +255,10 @@ def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, in
         net = ResnetGenerator(input_nc, output_nc, ngf, norm_layer=norm_layer, use_dropout=use_dropout, n_blocks=9)
     elif netG == 'resnet_6blocks':
         net = ResnetGenerator(input_nc, output_nc, ngf, norm_layer=norm_layer, use_dropout=use_dropout, n_blocks=6)
+    elif netG == 'resnet_9blocks_rev':
+        net = ResnetGenerator(input_nc, output_nc, ngf, norm_layer=norm_layer, use_dropout=use_dropout, n_blocks=9, reversible=True)
+    elif netG == 'resnet_6blocks_rev':
+        net = ResnetGenerator(input_nc, output_nc, ngf, norm_layer=norm_layer, use_dropout=use_dropout, n_blocks=6, reversible=True)
     elif netG == 'unet_128':
         net = UnetGenerator(input_nc, output_nc, 7, ngf, norm_layer=norm_layer, use_dropout=use_dropout)
     elif netG == 'unet_256':
@@ -191,6 +298,9 @@ def define_D(input_nc, ndf, netD, n_layers_D=3, norm='batch', init_type='normal'
         [pixel]: 1x1 PixelGAN discriminator can classify whether a pixel is real or not.
         It encourages greater color diversity but has no effect on spatial statistics.
 
+        [time_input_pool | time_diffmap_pool]: like [time_input | time_diffmap], but with global pooling before a small
+        MLP head, so they work at any input size (e.g. 64 or 128 px) and have far fewer parameters.
+
     The discriminator has been initialized by <init_net>. It uses Leakly RELU for non-linearity.
     """
     net = None
@@ -204,10 +314,14 @@ def define_D(input_nc, ndf, netD, n_layers_D=3, norm='batch', init_type='normal'
         net = PixelDiscriminator(input_nc, ndf, norm_layer=norm_layer)
     elif netD == 'time_input' or netD == 'time_diffmap':
         net = TimeDiscriminator(input_nc, ndf, norm_layer=norm_layer)
+    elif netD == 'time_input_pool' or netD == 'time_diffmap_pool':
+        net = TimeDiscriminatorPool(input_nc, ndf, norm_layer=norm_layer)
     elif netD == 'time_hist':
         net = TimeDiscriminatorHist(input_nc, ndf, norm_layer=norm_layer, input_size=255)
     elif netD == 'autoenc':
         net = AutoEncoderNet(input_nc, ndf, norm_layer=norm_layer, hidden_size=256)
+    elif netD == 'autoenc_conv':
+        net = AutoEncoderConvNet(input_nc, ndf, norm_layer=norm_layer, hidden_size=256)
     elif netD == 'time_autoenc':
         net = TimeDiscriminatorAutoEnc(input_nc, ndf, norm_layer=norm_layer, input_size=256)
     else:
@@ -276,14 +390,16 @@ class GANLoss(nn.Module):
         Returns:
             the calculated loss.
         """
-        if self.gan_mode in ['lsgan', 'vanilla']:
-            target_tensor = self.get_target_tensor(prediction, target_is_real)
-            loss = self.loss(prediction, target_tensor)
-        elif self.gan_mode == 'wgangp':
-            if target_is_real:
-                loss = -prediction.mean()
-            else:
-                loss = prediction.mean()
+        with autocast_disabled(prediction.device):  # always in float32, also with '--amp'
+            prediction = prediction.float()
+            if self.gan_mode in ['lsgan', 'vanilla']:
+                target_tensor = self.get_target_tensor(prediction, target_is_real)
+                loss = self.loss(prediction, target_tensor)
+            elif self.gan_mode == 'wgangp':
+                if target_is_real:
+                    loss = -prediction.mean()
+                else:
+                    loss = prediction.mean()
         return loss
 
 
@@ -300,38 +416,237 @@ def cal_gradient_penalty(netD, real_data, fake_data, device, type='mixed', const
         lambda_gp (float)           -- weight for this loss
 
     Returns the gradient penalty loss
+    The penalty is always computed in float32, also with '--amp'. It only reaches the weights of netD: the images are
+    detached first. type='real' with constant=0 gives the R1 penalty (https://arxiv.org/abs/1801.04406), scaled by <lambda_gp>.
     """
     if lambda_gp > 0.0:
-        if type == 'real':   # either use real images, fake images, or a linear interpolation of two.
-            interpolatesv = real_data
-        elif type == 'fake':
-            interpolatesv = fake_data
-        elif type == 'mixed':
-            alpha = torch.rand(real_data.shape[0], 1)
-            alpha = alpha.expand(real_data.shape[0], real_data.nelement() // real_data.shape[0]).contiguous().view(*real_data.shape)
-            alpha = alpha.to(device)
-            interpolatesv = alpha * real_data + ((1 - alpha) * fake_data)
-        else:
-            raise NotImplementedError('{} not implemented'.format(type))
-        interpolatesv.requires_grad_(True)
-        disc_interpolates = netD(interpolatesv)
-        gradients = torch.autograd.grad(outputs=disc_interpolates, inputs=interpolatesv,
-                                        grad_outputs=torch.ones(disc_interpolates.size()).to(device),
-                                        create_graph=True, retain_graph=True, only_inputs=True)
-        gradients = gradients[0].view(real_data.size(0), -1)  # flat the data
-        gradient_penalty = (((gradients + 1e-16).norm(2, dim=1) - constant) ** 2).mean() * lambda_gp        # added eps
+        with autocast_disabled(real_data.device):
+            real_data, fake_data = real_data.detach().float(), fake_data.detach().float()
+            if type == 'real':   # either use real images, fake images, or a linear interpolation of two.
+                interpolatesv = real_data
+            elif type == 'fake':
+                interpolatesv = fake_data
+            elif type == 'mixed':
+                alpha = torch.rand((real_data.shape[0],) + (1,) * (real_data.dim() - 1), device=real_data.device)  # one alpha per sample, broadcast
+                interpolatesv = alpha * real_data + ((1 - alpha) * fake_data)
+            else:
+                raise NotImplementedError('{} not implemented'.format(type))
+            interpolatesv.requires_grad_(True)
+            disc_interpolates = netD(interpolatesv)
+            gradients = torch.autograd.grad(outputs=disc_interpolates, inputs=interpolatesv,
+                                            grad_outputs=torch.ones_like(disc_interpolates),
+                                            create_graph=True, retain_graph=True, only_inputs=True)
+            gradients = gradients[0].view(real_data.size(0), -1)  # flat the data
+            gradient_penalty = (((gradients + 1e-16).norm(2, dim=1) - constant) ** 2).mean() * lambda_gp        # added eps
         return gradient_penalty, gradients
     else:
         return 0.0, None
 
 
+def constant_channel_response(conv, input_size, channel=0):
+    """Return the response of a convolution to a single all-ones input channel (without the bias)
+
+    Parameters:
+        conv (nn.Conv2d | nn.ConvTranspose2d) -- a zero-padded convolution layer (groups=1)
+        input_size (int tuple)                -- the spatial size (H, W) of the layer input
+        channel (int)                         -- index of the constant input channel
+
+    A convolution over a spatially constant channel adds, at every output position, the sum of the kernel taps
+    that land inside the input. Away from the borders this is the full kernel sum; at the borders the zero
+    padding drops some taps. We build a 0/1 matrix per spatial axis that marks which taps are valid for each
+    output row/column and contract both with the kernel, which gives the exact response including the border
+    correction, without convolving a full-size tensor.
+
+    Returns a tensor of shape [C_out, H_out, W_out].
+    """
+    transposed = isinstance(conv, nn.ConvTranspose2d)
+    kernel = conv.weight[channel] if transposed else conv.weight[:, channel]  # [C_out, kH, kW]
+    valid = []
+    for axis in range(2):
+        n_in, k, s = input_size[axis], conv.kernel_size[axis], conv.stride[axis]
+        p, d = conv.padding[axis], conv.dilation[axis]
+        taps = torch.arange(k, device=kernel.device).view(1, -1) * d
+        if transposed:  # output y receives input i through tap t when i * s = y + p - t * d
+            n_out = (n_in - 1) * s - 2 * p + d * (k - 1) + conv.output_padding[axis] + 1
+            pos = torch.arange(n_out, device=kernel.device).view(-1, 1) + p - taps
+            mask = (pos >= 0) & (pos < n_in * s) & (pos % s == 0)
+        else:           # output y reads input i = y * s - p + t * d
+            n_out = (n_in + 2 * p - d * (k - 1) - 1) // s + 1
+            pos = torch.arange(n_out, device=kernel.device).view(-1, 1) * s - p + taps
+            mask = (pos >= 0) & (pos < n_in)
+        valid.append(mask.to(kernel.dtype))
+    return torch.einsum('yk,okl,xl->oyx', valid[0], kernel, valid[1])
+
+
+def conv_with_constant_channels(conv, input, constants):
+    """Apply a convolution to cat([constant channels, input], 1) without building the concatenated tensor
+
+    Parameters:
+        conv (nn.Conv2d | nn.ConvTranspose2d) -- a zero-padded convolution whose leading input channels are spatially constant
+        input (tensor)                        -- the remaining input channels, shape [N, C, H, W]
+        constants (tensor)                    -- the value of each constant channel per sample, shape [N, K]
+
+    By linearity, constant channel k adds constants[:, k] * <constant_channel_response>(conv, k) to the output,
+    so only the non-constant channels are actually convolved.
+    """
+    n_const = constants.shape[1]
+    if isinstance(conv, nn.ConvTranspose2d):
+        out = F.conv_transpose2d(input, conv.weight[n_const:], conv.bias, conv.stride, conv.padding,
+                                 conv.output_padding, conv.groups, conv.dilation)
+    else:
+        out = F.conv2d(input, conv.weight[:, n_const:], conv.bias, conv.stride, conv.padding, conv.dilation, conv.groups)
+    responses = torch.stack([constant_channel_response(conv, input.shape[2:], k) for k in range(n_const)])
+    return out + torch.einsum('nk,kohw->nohw', constants.to(out.dtype), responses)
+
+
+def condition_D(netD, A, constants=None):
+    """Return the response of the first layer of the conditional discriminator <netD> to its condition A (see
+    <NLayerDiscriminator.condition_response>); pass it as <condition> to netD along with B only."""
+    net = netD.module if isinstance(netD, torch.nn.DataParallel) else netD
+    return net.condition_response(A, constants)
+
+
+def set_constant_folding(net, enabled=True):
+    """Enable or disable analytic folding of constant time channels in every TPN block of <net>"""
+    for module in net.modules():
+        if isinstance(module, UnetSkipConnectionBlockTPN):
+            module.fold_time = enabled
+
+
+def set_checkpointing(nets, every=1):
+    """Recompute the activations of the generators in <nets> during the backward pass instead of storing them
+
+    Parameters:
+        nets (network list) -- networks containing U-Net (also with TPN) or ResNet generators
+        every (int)         -- U-Net: checkpoint every <every>-th level, counting from the outermost one;
+                               ResNet: checkpoint groups of <every> ResNet blocks; 0 disables checkpointing
+
+    A checkpointed U-Net level stores only the inputs of its downsampling and upsampling paths; a checkpointed group of
+    ResNet blocks stores only its input. Both cost about one extra forward pass of the checkpointed layers.
+    Note that BatchNorm layers in checkpointed parts update their running statistics twice per step.
+    """
+    if not isinstance(nets, list):
+        nets = [nets]
+    for module in [m for net in nets for m in net.modules()]:
+        if isinstance(module, (UnetGenerator, UnetGeneratorTPN)):
+            blocks = [m for m in module.modules() if isinstance(m, (UnetSkipConnectionBlock, UnetSkipConnectionBlockTPN))]
+            for depth, block in enumerate(blocks):  # modules() lists the nested levels from the outermost one
+                block.checkpoint = every > 0 and depth % every == 0
+        elif isinstance(module, ResnetGenerator):
+            module.checkpoint_every = every
+
+
+def checkpoint(function, *args):
+    """Run <function>(*args) without storing its intermediate activations; they are recomputed in the backward pass
+
+    We use the non-reentrant implementation where available. The reentrant one (older PyTorch) returns no gradients
+    for the weights if no input requires gradients, so we run <function> normally in that case.
+    """
+    if 'use_reentrant' in inspect.signature(torch_checkpoint).parameters:
+        return torch_checkpoint(function, *args, use_reentrant=False)
+    if not any(torch.is_tensor(arg) and arg.requires_grad for arg in args):
+        return function(*args)
+    return torch_checkpoint(function, *args)
+
+
+def run_out_of_place(layers, x):
+    """Run the layers of a Sequential on x; a leading in-place (Leaky)ReLU is applied out of place, so x is kept intact
+
+    Checkpointed functions must not modify their inputs, since those are needed again for the recomputation.
+    """
+    first = layers[0]
+    if isinstance(first, nn.LeakyReLU):
+        x = F.leaky_relu(x, first.negative_slope)
+    elif isinstance(first, nn.ReLU):
+        x = F.relu(x)
+    else:
+        x = first(x)
+    return layers[1:](x)
+
+
+def size_multiple(net, n_layers_D=3):
+    """Return (multiple, min_size): the input sizes that network <net> (a define_G or define_D name) accepts
+
+    A U-Net halves its input <num_downs> times down to 1x1, so it only runs on multiples of 2^num_downs.
+    The ResNet generators downsample by 4, and the ReflectionPad2d(1) of their blocks needs a trunk of at least 2x2.
+    A PatchGAN needs at least a few positions after its strided layers.
+    """
+    if net.startswith('unet_128'):
+        return 128, 128
+    if net.startswith('unet_256'):
+        return 256, 256
+    if net == 'basic':
+        return 8, 32
+    if net == 'n_layers':
+        return 2 ** n_layers_D, 2 ** n_layers_D * 4
+    if net == 'pixel':
+        return 1, 1
+    return 4, 8  # resnet_*: 2 strided convolutions
+
+
+def check_foreground_crop(netG, crop_size):
+    """Warn if '--crop_foreground' cannot shrink the input of generator <netG> on frames of <crop_size>"""
+    if size_multiple(netG)[1] >= crop_size:
+        print('warning: [%s] only accepts inputs of at least %d px, so with --crop_size %d, --crop_foreground runs G on '
+              'the full frame and only crops D (with --crop_loss crop)' % (netG, size_multiple(netG)[1], crop_size))
+
+
+def round_box(box, size, multiple, min_size=1):
+    """Grow box (y0, y1, x0, x1) to a height and width that are multiples of <multiple> (and at least <min_size>)
+
+    The box is grown symmetrically and shifted to stay inside a frame of spatial size <size> (H, W), so it always
+    contains the original box.
+    """
+    rounded = []
+    for lo, hi, n in [(box[0], box[1], size[0]), (box[2], box[3], size[1])]:
+        length = min(n, max(min_size, multiple, -(-(hi - lo) // multiple) * multiple))
+        lo = max(0, min(lo - (length - (hi - lo)) // 2, n - length))
+        rounded += [lo, lo + length]
+    return tuple(rounded)
+
+
+def foreground_box(images, multiple, min_size=1, background=-1.0):
+    """Return the union bounding box (y0, y1, x0, x1) of the non-background pixels of a batch of images
+
+    Parameters:
+        images (tensor list) -- images of the same size [N, C, H, W]; pixels equal to <background> are empty
+        multiple (int)       -- the box height and width are rounded up to a multiple of this value
+        min_size (int)       -- minimum box height and width
+
+    A batch without any content gives a centered box of the minimum size (see <round_box>).
+    """
+    H, W = images[0].shape[2:]
+    mask = sum((image > background).sum(1).sum(0) for image in images) > 0  # [H, W]
+    rows, cols = mask.any(1), mask.any(0)
+    # first and last non-empty row and column, computed on the device and read back with a single host sync
+    index_H, index_W = torch.arange(H, device=mask.device), torch.arange(W, device=mask.device)
+    y0, y1, x0, x1, empty = torch.stack([index_H.masked_fill(~rows, H).min(), index_H.masked_fill(~rows, -1).max() + 1,
+                                         index_W.masked_fill(~cols, W).min(), index_W.masked_fill(~cols, -1).max() + 1,
+                                         (~rows).all().long()]).tolist()
+    if empty:
+        return round_box((H // 2, H // 2, W // 2, W // 2), (H, W), multiple, min_size)
+    return round_box((y0, y1, x0, x1), (H, W), multiple, min_size)
+
+
+def crop_box(image, box):
+    """Crop a batch of images [N, C, H, W] to box (y0, y1, x0, x1)"""
+    y0, y1, x0, x1 = box
+    return image[:, :, y0:y1, x0:x1]
+
+
+def paste_box(image, box, size, background=-1.0):
+    """Paste a batch of images cropped to box (y0, y1, x0, x1) back into empty frames of spatial size <size> (H, W)"""
+    y0, y1, x0, x1 = box
+    return F.pad(image, (x0, size[1] - x1, y0, size[0] - y1), value=background)
+
+
 class ResnetGenerator(nn.Module):
     """Resnet-based generator that consists of Resnet blocks between a few downsampling/upsampling operations.
 
     We adapt Torch code and idea from Justin Johnson's neural style transfer project(https://github.com/jcjohnson/fast-neural-style)
     """
 
-    def __init__(self, input_nc, output_nc, ngf=64, norm_layer=nn.BatchNorm2d, use_dropout=False, n_blocks=6, padding_type='reflect'):
+    def __init__(self, input_nc, output_nc, ngf=64, norm_layer=nn.BatchNorm2d, use_dropout=False, n_blocks=6, padding_type='reflect', reversible=False):
         """Construct a Resnet-based generator
 
         Parameters:
@@ -342,6 +657,7 @@ class ResnetGenerator(nn.Module):
             use_dropout (bool)  -- if use dropout layers
             n_blocks (int)      -- the number of ResNet blocks
             padding_type (str)  -- the name of padding layer in conv layers: reflect | replicate | zero
+            reversible (bool)   -- build the trunk from reversible blocks (see <ReversibleSequence>)
         """
         assert(n_blocks >= 0)
         super(ResnetGenerator, self).__init__()
@@ -363,9 +679,15 @@ class ResnetGenerator(nn.Module):
                       nn.ReLU(True)]
 
         mult = 2 ** n_downsampling
-        for i in range(n_blocks):       # add ResNet blocks
+        if reversible:  # add reversible ResNet blocks; their activations are reconstructed in the backward pass
+            if use_dropout:
+                print('dropout is not supported in reversible ResNet blocks; building them without dropout')
+            model += [ReversibleSequence([ReversibleResnetBlock(ngf * mult, padding_type=padding_type, norm_layer=norm_layer, use_bias=use_bias)
+                                          for i in range(n_blocks)])]
+        else:
+            for i in range(n_blocks):       # add ResNet blocks
 
-            model += [ResnetBlock(ngf * mult, padding_type=padding_type, norm_layer=norm_layer, use_dropout=use_dropout, use_bias=use_bias)]
+                model += [ResnetBlock(ngf * mult, padding_type=padding_type, norm_layer=norm_layer, use_dropout=use_dropout, use_bias=use_bias)]
 
         for i in range(n_downsampling):  # add upsampling layers
             mult = 2 ** (n_downsampling - i)
@@ -380,10 +702,19 @@ class ResnetGenerator(nn.Module):
         model += [nn.Tanh()]
 
         self.model = nn.Sequential(*model)
+        self.checkpoint_every = 0  # see <set_checkpointing>
 
     def forward(self, input):
         """Standard forward"""
-        return self.model(input)
+        if self.checkpoint_every == 0 or not torch.is_grad_enabled():
+            return self.model(input)
+        blocks = [i for i, layer in enumerate(self.model) if isinstance(layer, ResnetBlock)]
+        if not blocks:
+            return self.model(input)
+        x = self.model[:blocks[0]](input)
+        for i in range(blocks[0], blocks[-1] + 1, self.checkpoint_every):  # one checkpoint per group of blocks
+            x = checkpoint(self.model[i:min(i + self.checkpoint_every, blocks[-1] + 1)], x)
+        return self.model[blocks[-1] + 1:](x)
 
 
 class ResnetBlock(nn.Module):
@@ -446,6 +777,96 @@ class ResnetBlock(nn.Module):
         return out
 
 
+class ReversibleResnetBlock(ResnetBlock):
+    """Define a reversible (additive coupling) Resnet block
+
+    The channels are split into two halves (x1, x2), and
+        y1 = x1 + F(x2),  y2 = x2 + G(y1)
+    where F and G are the conv blocks of a ResnetBlock with half the channels. The input can be recovered exactly from
+    the output: x2 = y2 - G(y1), x1 = y1 - F(x2). RevNet paper: https://arxiv.org/abs/1707.04585
+    """
+
+    def __init__(self, dim, padding_type, norm_layer, use_bias):
+        """Initialize the reversible Resnet block (no dropout, since the blocks must be deterministic to be inverted)"""
+        nn.Module.__init__(self)
+        assert dim % 2 == 0, 'reversible blocks need an even number of channels'
+        self.F = self.build_conv_block(dim // 2, padding_type, norm_layer, False, use_bias)
+        self.G = self.build_conv_block(dim // 2, padding_type, norm_layer, False, use_bias)
+
+    def forward(self, x):
+        """Forward function (with additive coupling)"""
+        x1, x2 = torch.chunk(x, 2, dim=1)
+        y1 = x1 + self.F(x2)
+        y2 = x2 + self.G(y1)
+        return torch.cat([y1, y2], 1)
+
+    def inverse(self, y):
+        """Reconstruct the input of <forward> from its output"""
+        y1, y2 = torch.chunk(y, 2, dim=1)
+        x2 = y2 - self.G(y1)
+        x1 = y1 - self.F(x2)
+        return torch.cat([x1, x2], 1)
+
+
+def autocast_state(device_type):
+    """Return the current autocast (enabled, dtype) on <device_type>, or None if this PyTorch version has no autocast"""
+    if not hasattr(torch, 'autocast'):
+        return None
+    if device_type == 'cuda':
+        return torch.is_autocast_enabled(), torch.get_autocast_gpu_dtype()
+    return torch.is_autocast_cpu_enabled(), torch.get_autocast_cpu_dtype()
+
+
+class ReversibleFunction(torch.autograd.Function):
+    """Run a list of reversible blocks without storing their activations
+
+    The forward pass keeps only the output. The backward pass walks the blocks in reverse order, reconstructs each
+    block's input from its output with <inverse>, reruns the block with gradients and backpropagates through it.
+    The parameters are passed as inputs only so that the output requires gradients; their gradients are accumulated
+    by the inner backward passes.
+    """
+
+    @staticmethod
+    def forward(ctx, x, blocks, *params):
+        ctx.blocks = blocks
+        ctx.autocast = autocast_state(x.device.type)  # rerun the blocks in the same precision in the backward pass
+        with torch.no_grad():
+            for block in blocks:
+                x = block(x)
+        ctx.save_for_backward(x)
+        return x
+
+    @staticmethod
+    def backward(ctx, grad_y):
+        y, = ctx.saved_tensors
+        device_type = y.device.type
+        with autocast_disabled(y.device) if ctx.autocast is None else torch.autocast(device_type, dtype=ctx.autocast[1], enabled=ctx.autocast[0]):
+            for block in reversed(ctx.blocks):
+                with torch.no_grad():
+                    x = block.inverse(y)
+                x = x.detach().requires_grad_(True)
+                with torch.enable_grad():
+                    y_again = block(x)
+                torch.autograd.backward(y_again, grad_y)
+                grad_y, y = x.grad, x.detach()
+        return (grad_y, None) + (None,) * (len(ctx.needs_input_grad) - 2)
+
+
+class ReversibleSequence(nn.Module):
+    """A sequence of reversible blocks whose activation memory does not depend on the number of blocks"""
+
+    def __init__(self, blocks):
+        super(ReversibleSequence, self).__init__()
+        self.blocks = nn.ModuleList(blocks)
+
+    def forward(self, x):
+        if not torch.is_grad_enabled():
+            for block in self.blocks:
+                x = block(x)
+            return x
+        return ReversibleFunction.apply(x, list(self.blocks), *[p for p in self.parameters() if p.requires_grad])
+
+
 class UnetGenerator(nn.Module):
     """Create a Unet-based generator"""
 
@@ -500,6 +921,8 @@ class UnetSkipConnectionBlock(nn.Module):
         """
         super(UnetSkipConnectionBlock, self).__init__()
         self.outermost = outermost
+        self.innermost = innermost
+        self.checkpoint = False  # see <set_checkpointing>
         if type(norm_layer) == functools.partial:
             use_bias = norm_layer.func == nn.InstanceNorm2d
         else:
@@ -539,14 +962,33 @@ class UnetSkipConnectionBlock(nn.Module):
             else:
                 model = down + [submodule] + up
 
+        self.n_down = len(down)  # self.model is down + [submodule] + up
         self.model = nn.Sequential(*model)
 
     def forward(self, x):
+        if self.checkpoint and torch.is_grad_enabled():
+            return self.forward_checkpointed(x)
         if self.outermost:
             return self.model(x)
         else:   # add skip connections
             return torch.cat([x, self.model(x)], 1)
 
+    def forward_checkpointed(self, x):
+        """Same as <forward>, but the downsampling and upsampling paths are checkpointed (see <set_checkpointing>)"""
+        down = self.model[:self.n_down]
+        up = self.model[self.n_down + (0 if self.innermost else 1):]
+        if not self.outermost:
+            # the in-place LeakyReLU of the down path also acts on the skip connection; apply it out of place here
+            x = run_out_of_place(down[:1], x)
+            down = down[1:]
+        y = checkpoint(down, x)
+        if not self.innermost:
+            y = self.model[self.n_down](y)
+        y = checkpoint(functools.partial(run_out_of_place, up), y)
+        if self.outermost:
+            return y
+        return torch.cat([x, y], 1)
+
 class UnetGeneratorTPN(nn.Module):
     """Create a Unet-based generator with added channels on the transpose convolution for the time"""
 
@@ -575,8 +1017,13 @@ class UnetGeneratorTPN(nn.Module):
         self.model = UnetSkipConnectionBlockTPN(output_nc, ngf, input_nc=input_nc, submodule=unet_block, outermost=True, norm_layer=norm_layer)  # add the outermost layer
 
     def forward(self, input, time):
-        """Standard forward"""
-        return self.model(input, time)
+        """Standard forward
+
+        Parameters:
+            input (tensor) -- input images, shape [N, C, H, W]
+            time (tensor)  -- time period per sample, any shape with N (or 1) elements, e.g. [N], [N, 1] or [N, 1, 1, 1]
+        """
+        return self.model(input, time.view(-1, 1, 1, 1))
 
 class UnetSkipConnectionBlockTPN(nn.Module):
     """Defines the Unet submodule with skip connection.
@@ -601,6 +1048,8 @@ class UnetSkipConnectionBlockTPN(nn.Module):
         super(UnetSkipConnectionBlockTPN, self).__init__()
         self.innermost = innermost
         self.outermost = outermost
+        self.fold_time = False  # see <set_constant_folding>
+        self.checkpoint = False  # see <set_checkpointing>
         if type(norm_layer) == functools.partial:
             use_bias = norm_layer.func == nn.InstanceNorm2d
         else:
@@ -646,10 +1095,25 @@ class UnetSkipConnectionBlockTPN(nn.Module):
         self.submodule = submodule
         self.up = nn.Sequential(*up)
 
+    def up_with_time(self, x, time):
+        """Run the upsampling path on cat([time, x], 1)
+
+        With <fold_time>, the constant time channel is folded analytically into the transposed convolution
+        (see <conv_with_constant_channels>) instead of being expanded to full size and concatenated.
+        """
+        if not self.fold_time:
+            return self.up(torch.cat([time.expand(x.shape[0], 1, x.shape[2], x.shape[3]), x], 1))
+        uprelu, upconv, upnorm = self.up
+        constants = F.relu(time.view(-1, 1)).expand(x.shape[0], 1)  # uprelu also acts on the time channel
+        return upnorm(conv_with_constant_channels(upconv, F.relu(x), constants))  # out of place: x may be a checkpoint input
+
     def forward(self, x, time):
 
         # print(x.size())
 
+        if self.checkpoint and torch.is_grad_enabled():
+            return self.forward_checkpointed(x, time)
+
         # Concatenate time layer on every upconvolution
         # except for theoutermost layer
         if self.outermost:
@@ -658,14 +1122,25 @@ class UnetSkipConnectionBlockTPN(nn.Module):
             return self.up(x2)
         elif self.innermost:
             x1 = self.down(x)
-            x1_and_time = torch.cat([time.expand(1, 1, x1.shape[2], x1.shape[3]), x1], 1)
-            x2 = self.up(x1_and_time)
+            x2 = self.up_with_time(x1, time)
             return torch.cat([x2, x], 1)
         else:
             x1 = self.down(x)
             x2 = self.submodule(x1, time)
-            x2_and_time = torch.cat([time.expand(1, 1, x2.shape[2], x2.shape[3]), x2], 1)
-            return torch.cat([self.up(x2_and_time), x], 1)
+            return torch.cat([self.up_with_time(x2, time), x], 1)
+
+    def forward_checkpointed(self, x, time):
+        """Same as <forward>, but the downsampling and upsampling paths are checkpointed (see <set_checkpointing>)"""
+        down = self.down
+        if not self.outermost:
+            # the in-place LeakyReLU of the down path also acts on the skip connection; apply it out of place here
+            x = run_out_of_place(down[:1], x)
+            down = down[1:]
+        x1 = checkpoint(down, x)
+        if self.outermost:
+            return checkpoint(functools.partial(run_out_of_place, self.up), self.submodule(x1, time))
+        x2 = x1 if self.innermost else self.submodule(x1, time)
+        return torch.cat([checkpoint(self.up_with_time, x2, time), x], 1)
 
 class NLayerDiscriminator(nn.Module):
     """Defines a PatchGAN discriminator"""
@@ -710,9 +1185,35 @@ class NLayerDiscriminator(nn.Module):
         sequence += [nn.Conv2d(ndf * nf_mult, 1, kernel_size=kw, stride=1, padding=padw)]  # output 1 channel prediction map
         self.model = nn.Sequential(*sequence)
 
-    def forward(self, input):
-        """Standard forward."""
-        return self.model(input)
+    def forward(self, input, constants=None, condition=None):
+        """Standard forward.
+
+        If <constants> ([N, K]) is given, the network sees K spatially constant channels in front of <input>;
+        they are folded into the first convolution instead of being concatenated.
+        If <condition> (from <condition_response>) is given, <input> holds only the last input channels; only they are
+        convolved by the first layer, and the precomputed response of the leading channels is added.
+        """
+        if condition is not None:
+            conv = self.model[0]
+            out = F.conv2d(input, conv.weight[:, -input.shape[1]:], None, conv.stride, conv.padding, conv.dilation, conv.groups)
+            return self.model[1:](out + condition)
+        if constants is None:
+            return self.model(input)
+        return self.model[1:](conv_with_constant_channels(self.model[0], input, constants))
+
+    def condition_response(self, A, constants=None):
+        """Return the first convolution's response (with its bias) to the leading input channels [constants, A]
+
+        The first convolution is linear, so its weight can be split by input channels: a conditional discriminator
+        convolves its condition A once and passes the result as <condition> to each <forward> call on a different B.
+        """
+        conv = self.model[0]
+        n_const = 0 if constants is None else constants.shape[1]
+        out = F.conv2d(A, conv.weight[:, n_const:n_const + A.shape[1]], conv.bias, conv.stride, conv.padding, conv.dilation, conv.groups)
+        if n_const:
+            responses = torch.stack([constant_channel_response(conv, A.shape[2:], k) for k in range(n_const)])
+            out = out + torch.einsum('nk,kohw->nohw', constants.to(out.dtype), responses)
+        return out
 
 
 class PixelDiscriminator(nn.Module):
@@ -742,9 +1243,11 @@ class PixelDiscriminator(nn.Module):
 
         self.net = nn.Sequential(*self.net)
 
-    def forward(self, input):
-        """Standard forward."""
-        return self.net(input)
+    def forward(self, input, constants=None):
+        """Standard forward. <constants> are folded into the first convolution, see <NLayerDiscriminator.forward>"""
+        if constants is None:
+            return self.net(input)
+        return self.net[1:](conv_with_constant_channels(self.net[0], input, constants))
 
 class Flatten(nn.Module):
 
@@ -824,6 +1327,65 @@ class TimeDiscriminator(nn.Module):
         """Standard forward."""
         return self.net(input)
 
+class TimeDiscriminatorPool(nn.Module):
+    """Defines a resolution-agnostic TimeDiscriminator
+
+    It uses the same convolutional feature extractor as TimeDiscriminator, but replaces the flattening and the large
+    nn.Linear(ndf * 3 * 30 * 30, 500) layer with global average and max pooling followed by a small MLP head.
+    """
+
+    def __init__(self, input_nc, ndf=64, norm_layer=nn.BatchNorm2d):
+        """Construct a TimeDiscriminatorPool
+
+        Parameters:
+            input_nc (int)  -- the number of channels in input images
+            ndf (int)       -- the number of filters in the last conv layer
+            norm_layer      -- normalization layer
+        """
+        super(TimeDiscriminatorPool, self).__init__()
+        if type(norm_layer) == functools.partial:  # no need to use bias as BatchNorm2d has affine parameters
+            use_bias = norm_layer.func != nn.InstanceNorm2d
+        else:
+            use_bias = norm_layer != nn.InstanceNorm2d
+
+        self.features = nn.Sequential(
+            nn.Conv2d(input_nc, ndf, kernel_size=3, stride=1, bias=use_bias),
+            nn.ReLU(),
+            nn.MaxPool2d(kernel_size=2),
+            norm_layer(ndf),
+
+            nn.Conv2d(ndf, ndf * 2, kernel_size=3, stride=1, bias=use_bias),
+            nn.ReLU(),
+            nn.MaxPool2d(kernel_size=2),
+            norm_layer(ndf * 2),
+
+            nn.Conv2d(ndf * 2, ndf * 3, kernel_size=3, stride=1, bias=use_bias),
+            nn.ReLU(),
+            nn.MaxPool2d(kernel_size=2),
+            norm_layer(ndf * 3),
+        )
+        self.avg_pool = nn.AdaptiveAvgPool2d(1)
+        self.max_pool = nn.AdaptiveMaxPool2d(1)
+
+        self.head = nn.Sequential(
+            # Input size of linear = filters * (average + max pooling)
+            nn.Linear(ndf * 3 * 2, 100),
+            nn.ReLU(),
+            nn.Dropout(0.25),
+
+            nn.Linear(100, 20),
+            nn.ReLU(),
+
+            nn.Linear(20, 1),
+            nn.ReLU(),
+        )
+
+    def forward(self, input):
+        """Standard forward."""
+        x = self.features(input)
+        x = torch.cat([self.avg_pool(x), self.max_pool(x)], 1)
+        return self.head(x.view(x.shape[0], -1))
+
 class TimeDiscriminatorHist(nn.Module):
     """Defines a TimeDiscriminatorHist"""
 
@@ -982,6 +1544,89 @@ class AutoEncoderNet(nn.Module):
         z = self.encode(input)
         return z
 
+class AutoEncoderConvNet(nn.Module):
+    """Defines an AutoEncoder with a convolutional bottleneck
+
+    Unlike AutoEncoderNet, it has no fully connected layers over the whole feature map, so it is much lighter and works
+    with any input size that is a multiple of 16. The encoder ends in a 1x1 convolution and global average pooling, which
+    gives a latent vector of <hidden_size> like AutoEncoderNet.forward_vectorOnly. The decoder is a spatial broadcast
+    decoder (https://arxiv.org/abs/1901.07017): the latent vector is tiled over the bottleneck grid together with
+    x/y coordinate channels, and then upsampled with transposed convolutions.
+    """
+
+    def __init__(self, input_nc, ndf=64, norm_layer=nn.BatchNorm2d, hidden_size=128):
+        """Construct an AutoEncoderConvNet
+
+        Parameters:
+            input_nc (int)    -- the number of channels in input images
+            ndf (int)         -- the number of filters in the first conv layer
+            norm_layer        -- normalization layer
+            hidden_size (int) -- the size of the latent vector
+        """
+        super(AutoEncoderConvNet, self).__init__()
+        if type(norm_layer) == functools.partial:  # no need to use bias as BatchNorm2d has affine parameters
+            use_bias = norm_layer.func != nn.BatchNorm2d
+        else:
+            use_bias = norm_layer != nn.BatchNorm2d
+
+        # Encoder
+        self.conv1 = nn.Conv2d(input_nc, ndf, kernel_size=3, stride=1, padding=1, bias=use_bias) # b x ndf x H/2 x W/2 after pooling
+        self.bn1 = norm_layer(ndf)
+        self.conv2 = nn.Conv2d(ndf, ndf * 2, kernel_size=3, stride=1, padding=1, bias=use_bias) # b x 2ndf x H/4 x W/4
+        self.bn2 = norm_layer(ndf * 2)
+        self.conv3 = nn.Conv2d(ndf * 2, ndf * 3, kernel_size=3, stride=1, padding=1, bias=use_bias) # b x 3ndf x H/8 x W/8
+        self.bn3 = norm_layer(ndf * 3)
+        self.conv4 = nn.Conv2d(ndf * 3, ndf * 4, kernel_size=3, stride=1, padding=1, bias=use_bias) # b x 4ndf x H/16 x W/16
+        self.bn4 = norm_layer(ndf * 4)
+        self.pool = nn.MaxPool2d(kernel_size=2, stride=2)
+        self.bottleneck = nn.Conv2d(ndf * 4, hidden_size, kernel_size=1) # b x hidden_size x H/16 x W/16, then pooled
+
+        # Decoder
+        self.conv5 = nn.Conv2d(hidden_size + 2, ndf * 4, kernel_size=3, stride=1, padding=1, bias=use_bias) # latent + x/y coordinates
+        self.bn5 = norm_layer(ndf * 4)
+        self.deconv1 = nn.ConvTranspose2d(ndf * 4, ndf * 3, kernel_size=4, stride=2, padding=1, bias=use_bias) # b x 3ndf x H/8 x W/8
+        self.bn6 = norm_layer(ndf * 3)
+        self.deconv2 = nn.ConvTranspose2d(ndf * 3, ndf * 2, kernel_size=4, stride=2, padding=1, bias=use_bias) # b x 2ndf x H/4 x W/4
+        self.bn7 = norm_layer(ndf * 2)
+        self.deconv3 = nn.ConvTranspose2d(ndf * 2, ndf, kernel_size=4, stride=2, padding=1, bias=use_bias) # b x ndf x H/2 x W/2
+        self.bn8 = norm_layer(ndf)
+        self.deconv4 = nn.ConvTranspose2d(ndf, input_nc, kernel_size=4, stride=2, padding=1) # b x input_nc x H x W
+
+    def encode(self, x):
+
+        x = F.relu(self.bn1(self.pool(self.conv1(x))))
+        x = F.relu(self.bn2(self.pool(self.conv2(x))))
+        x = F.relu(self.bn3(self.pool(self.conv3(x))))
+        x = F.relu(self.bn4(self.pool(self.conv4(x))))
+        x = F.relu(self.bottleneck(x))
+        x = F.adaptive_avg_pool2d(x, 1).view(x.shape[0], -1)
+
+        return x
+
+    def decode(self, z, size):
+
+        h, w = size[0] // 16, size[1] // 16
+        ys = torch.linspace(-1, 1, h, device=z.device, dtype=z.dtype).view(1, 1, h, 1).expand(z.shape[0], 1, h, w)
+        xs = torch.linspace(-1, 1, w, device=z.device, dtype=z.dtype).view(1, 1, 1, w).expand(z.shape[0], 1, h, w)
+        z = torch.cat([z.view(z.shape[0], -1, 1, 1).expand(-1, -1, h, w), ys, xs], 1)
+        z = F.relu(self.bn5(self.conv5(z)))
+        z = F.relu(self.bn6(self.deconv1(z)))
+        z = F.relu(self.bn7(self.deconv2(z)))
+        z = F.relu(self.bn8(self.deconv3(z)))
+        z = torch.tanh(self.deconv4(z))
+
+        return z
+
+    def forward(self, input):
+        z = self.encode(input)
+        recon = self.decode(z, input.shape[2:])
+
+        return recon
+
+    def forward_vectorOnly(self, input):
+        z = self.encode(input)
+        return z
+
 # Used to print shape of input using nn.Sequential
 class PrintLayer(nn.Module):
     def __init__(self):
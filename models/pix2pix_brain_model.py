@@ -38,12 +38,17 @@ class Pix2PixBrainModel(BaseModel):
         # changing the default values to match the pix2pix paper (https://phillipi.github.io/pix2pix/)
         parser.set_defaults(norm='batch', netG='unet_256', dataset_mode='aligned')
         parser.add_argument('--TPN', type=str, default=None, help='Use the Time Prediction Network (TPN), and load specified model')
+        parser.add_argument('--fold_time', action='store_true', help='with TPN, fold the constant time channels analytically into the convolutions instead of concatenating them')
+        parser.add_argument('--crop_foreground', action='store_true', help='run G on the bounding box of the non-zero content of each batch (rounded up to the sizes G accepts) and paste its output back. A U-Net only accepts its full size (256 px for unet_256), so on frames of that size G always runs on the full frame and only D is cropped (with --crop_loss crop)')
 
         if is_train:
             parser.set_defaults(pool_size=0, gan_mode='vanilla')
             parser.add_argument('--lambda_L1', type=float, default=100.0, help='weight for L1 loss')
             parser.add_argument('--lambda_L2', type=float, default=0.0, help='weight for tumour tissue over rest of brain. Range [0,1]')
             parser.add_argument('--gamma', type=float, default=1.0, help='weight for time loss, when TPN is set to True')
+            parser.add_argument('--crop_loss', type=str, default='paste', help='with --crop_foreground, where D and the L1 loss run [paste: on the full frame | crop: on the bounding box]')
+            parser.add_argument('--split_D', action='store_true', help="split the first conv of the conditional D [basic | n_layers] by input channels: real_A's part is computed once per D update and reused, and [real_A, B] is never concatenated")
+            parser.add_argument('--TPN_accel', type=str, default='none', help='inference acceleration for the auxiliary TPN [none | channels_last | compile]')
         return parser
 
     def __init__(self, opt):
@@ -80,10 +85,18 @@ class Pix2PixBrainModel(BaseModel):
         # define networks (both generator and discriminator)
         self.netG = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.netG, opt.norm,
                                       not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids)
+        if opt.crop_foreground:
+            networks.check_foreground_crop(opt.netG, opt.crop_size)
+        if self.TPN_enabled and opt.fold_time:
+            networks.set_constant_folding(self.netG, True)
+        if self.isTrain and opt.checkpoint_G > 0:  # recompute generator activations in the backward pass
+            networks.set_checkpointing(self.netG, opt.checkpoint_G)
 
         if self.isTrain:  # define a discriminator; 
             self.netD = networks.define_D(discr_input_nc, opt.ndf, opt.netD,
                                           opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
+            if opt.split_D:
+                assert opt.netD in ['basic', 'n_layers'], '--split_D needs a PatchGAN discriminator [basic | n_layers]'
 
             if self.TPN_enabled:
                 self.loss_names = ['G_GAN', 'G_L1', 'G_TPN', 'D_real', 'D_fake']
@@ -110,13 +123,20 @@ class Pix2PixBrainModel(BaseModel):
                 self.TPN = create_model(opt_TPN)      # create a model given opt_TPN.model and other options
                 self.TPN.setup(opt_TPN)               # regular setup: load
 
+                # The TPN is frozen: never optimised here (gradients only need to reach fake_B through it), and in
+                # eval mode so that generated images do not update its BatchNorm statistics or draw dropout masks
+                self.set_requires_grad(self.TPN.netD, False)
+                self.TPN.eval()
+                self.TPN.netD = networks.accelerate_net(self.TPN.netD, opt.TPN_accel)
+                self.TPN_channels_last = opt.TPN_accel == 'channels_last'
+
         if self.isTrain:
             # define loss functions
             self.criterionGAN = networks.GANLoss(opt.gan_mode).to(self.device)
             self.criterionL1 = torch.nn.L1Loss()
             # initialize optimizers; schedulers will be automatically created by function <BaseModel.setup>.
-            self.optimizer_G = torch.optim.Adam(self.netG.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
-            self.optimizer_D = torch.optim.Adam(self.netD.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
+            self.optimizer_G = self.create_adam(self.netG.parameters())
+            self.optimizer_D = self.create_adam(self.netD.parameters())
             self.optimizers.append(self.optimizer_G)
             self.optimizers.append(self.optimizer_D)
 
@@ -132,95 +152,155 @@ class Pix2PixBrainModel(BaseModel):
         The option 'direction' can be used to swap images in domain A and domain B.
         """
         AtoB = self.opt.direction == 'AtoB'
-        self.real_A = input['A' if AtoB else 'B'].to(self.device)
-        self.real_B = input['B' if AtoB else 'A'].to(self.device)
-        self.true_time = input['time_period'][0]
+        self.real_A = self.image_to_device(input['A' if AtoB else 'B'])
+        self.real_B = self.image_to_device(input['B' if AtoB else 'A'])
+        self.true_time = input['time_period'].float().to(self.device)  # one time period per sample, shape [N]
         self.image_paths = input['A_paths' if AtoB else 'B_paths']
+        if self.opt.crop_foreground:  # bounding box of the batch content for G, grown to the sizes D accepts for D
+            # training: the union with real_B keeps the L1 loss exact (see <l1_scale>); inference and validation
+            # (eval mode): real_A only, as the extent of the ground truth is unknown there
+            images = [self.real_A, self.real_B] if self.isTrain and self.netG.training else [self.real_A]
+            self.box_G = networks.foreground_box(images, *networks.size_multiple(self.opt.netG))
+            if self.isTrain and self.opt.crop_loss == 'crop':
+                self.box_D = networks.round_box(self.box_G, self.real_A.shape[2:], *networks.size_multiple(self.opt.netD, self.opt.n_layers_D))
 
     def forward(self):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
         if self.TPN_enabled:
-            self.fake_B = self.netG(self.real_A, torch.ones((1,1)) * self.true_time) # Pass the image and time
+            self.fake_B = self.generate(self.real_A, self.true_time.view(-1, 1, 1, 1)) # Pass the image and time
 
             if self.isTrain:
                 # Predict the time between real image A and generated image B
-                self.TPN.real_A = self.real_A
-                self.TPN.real_B = self.fake_B
+                if self.TPN_channels_last:
+                    self.TPN.real_A = self.real_A.contiguous(memory_format=torch.channels_last)
+                    self.TPN.real_B = self.fake_B.contiguous(memory_format=torch.channels_last)
+                else:
+                    self.TPN.real_A = self.real_A
+                    self.TPN.real_B = self.fake_B
                 self.TPN.forward()
                 self.fake_time = self.TPN.prediction
         else:
-            self.fake_B = self.netG(self.real_A)  # G(A)
+            self.fake_B = self.generate(self.real_A)  # G(A)
+
+    def generate(self, real_A, *time):
+        """Run G on <real_A>; with '--crop_foreground', on the bounding box only, pasted back into an empty frame"""
+        if not self.opt.crop_foreground:
+            return self.netG(real_A, *time)
+        return networks.paste_box(self.netG(networks.crop_box(real_A, self.box_G), *time), self.box_G, real_A.shape[2:])
+
+    def train(self):
+        """Make models train mode again (e.g. after a validation pass); the frozen TPN stays in eval mode"""
+        BaseModel.train(self)
+        if self.isTrain and self.TPN_enabled:  # the TPN is only loaded for training
+            self.TPN.eval()
+
+    def crop_D(self, image):
+        """Crop <image> to the region seen by D and the L1 loss (the full frame unless '--crop_loss crop')"""
+        if self.opt.crop_foreground and self.opt.crop_loss == 'crop':
+            return networks.crop_box(image, self.box_D)
+        return image
+
+    def l1_scale(self):
+        """Return the factor that makes an L1 loss on the <crop_D> region equal to the full-frame L1 loss.
+
+        The box contains G's box, which contains all non-background pixels of real_B, and G's output is background
+        outside its own box, so the pixels outside add nothing to the sum; only the mean's denominator changes.
+        """
+        if self.opt.crop_foreground and self.opt.crop_loss == 'crop':
+            y0, y1, x0, x1 = self.box_D
+            return float((y1 - y0) * (x1 - x0)) / (self.real_B.shape[2] * self.real_B.shape[3])
+        return 1.0
+
+    def discriminate(self, B, condition=None):
+        """Run the conditional discriminator on input real_A and output B (and the time, if TPN is enabled)
+
+        With '--split_D', <condition> is D's first-layer response to real_A and the time (from <condition_D>), and
+        only B goes through the first layer.
+        """
+        if condition is not None:
+            return self.netD(self.crop_D(B), condition=condition)
+        A, B = self.crop_D(self.real_A), self.crop_D(B)
+        if not self.TPN_enabled:
+            return self.netD(torch.cat((A, B), 1))  # we use conditional GANs; we need to feed both input and output to the discriminator
+        if self.opt.fold_time:
+            # The time layer is constant per sample, so netD folds it into its first conv instead of receiving it as a full-size channel
+            return self.netD(torch.cat((A, B), 1), self.true_time.view(-1, 1).expand(-1, A.shape[1]))
+        true_time_layer = self.true_time.view(-1, 1, 1, 1).expand_as(A)  # broadcast view; no full-size allocation
+        return self.netD(torch.cat((true_time_layer, A, B), 1))  # we use conditional GANs with TPN; we need to feed both time, input and output to the discriminator
+
+    def condition_D(self):
+        """Return the <condition> for <discriminate> with '--split_D' (computed with D's current weights), otherwise None
+
+        The time channels are spatially constant, so they are folded into the response as in '--fold_time'.
+        """
+        if not self.opt.split_D:
+            return None
+        A = self.crop_D(self.real_A)
+        constants = self.true_time.view(-1, 1).expand(-1, A.shape[1]) if self.TPN_enabled else None
+        return networks.condition_D(self.netD, A, constants)
 
     def backward_D(self):
         """Calculate GAN loss for the discriminator"""
+        condition = self.condition_D()  # shared by the fake and real passes
         # Fake; stop backprop to the generator by detaching fake_B
-        if self.TPN_enabled:
-            self.true_time_layer = (torch.ones(self.real_A.shape) * self.true_time).to(self.device)
-            fake_AB = torch.cat((self.true_time_layer, self.real_A, self.fake_B), 1)  # we use conditional GANs with TPN; we need to feed both time, input and output to the discriminator
-        else:
-            fake_AB = torch.cat((self.real_A, self.fake_B), 1)  # we use conditional GANs; we need to feed both input and output to the discriminator
-        pred_fake = self.netD(fake_AB.detach())
+        pred_fake = self.discriminate(self.fake_B.detach(), condition)
         self.loss_D_fake = self.criterionGAN(pred_fake, False)
 
         # Real
-        if self.TPN_enabled:
-            real_AB = torch.cat((self.true_time_layer, self.real_A, self.real_B), 1)
-        else:
-            real_AB = torch.cat((self.real_A, self.real_B), 1)
-        pred_real = self.netD(real_AB)
+        pred_real = self.discriminate(self.real_B, condition)
         self.loss_D_real = self.criterionGAN(pred_real, True)
 
         # combine loss and calculate gradients
         self.loss_D = (self.loss_D_fake + self.loss_D_real) * 0.5
-        self.loss_D.backward()
+        self.backward_loss(self.loss_D)
 
     def backward_G(self):
         """Calculate GAN and L1 loss for the generator"""
         # First, G(A) should fake the discriminator
-        if self.TPN_enabled:
-            fake_AB = torch.cat((self.true_time_layer, self.real_A, self.fake_B), 1)
-        else:
-            fake_AB = torch.cat((self.real_A, self.fake_B), 1)
-        pred_fake = self.netD(fake_AB)
+        pred_fake = self.discriminate(self.fake_B, self.condition_D())  # D has been updated since <backward_D>
         self.loss_G_GAN = self.criterionGAN(pred_fake, True)
         
         # Second, G(A) = B
         # Weighted L1 Loss
+        fake_B, real_B = self.crop_D(self.fake_B), self.crop_D(self.real_B)
         if self.opt.lambda_L2 > 0: # If lambda_L2 is not > 0, no need to perform extra computation
-            fake_B_tumour = self.fake_B.clone().detach()
-            real_B_tumour = self.real_B.clone().detach()
+            fake_B_tumour = fake_B.clone().detach()
+            real_B_tumour = real_B.clone().detach()
             fake_B_tumour[fake_B_tumour < 0.5] = 0
             real_B_tumour[fake_B_tumour < 0.5] = 0
-            self.loss_G_L1 = self.opt.lambda_L1 * (self.criterionL1(self.fake_B, self.real_B) * (1 - self.opt.lambda_L2) + \
-                             self.criterionL1(fake_B_tumour, real_B_tumour) * self.opt.lambda_L2)
+            self.loss_G_L1 = self.opt.lambda_L1 * (self.criterionL1(fake_B, real_B) * (1 - self.opt.lambda_L2) + \
+                             self.criterionL1(fake_B_tumour, real_B_tumour) * self.opt.lambda_L2) * self.l1_scale()
         else:
             ### ORIGINAL ###
-            self.loss_G_L1 = self.criterionL1(self.fake_B, self.real_B) * self.opt.lambda_L1
+            self.loss_G_L1 = self.criterionL1(fake_B, real_B) * self.opt.lambda_L1 * self.l1_scale()
 
         # TPN Loss
         if self.TPN_enabled:
-            true_time_tensor = torch.ones(self.fake_time.shape) * self.true_time
-            self.loss_G_TPN = self.criterionL1(true_time_tensor, self.fake_time.cpu()) * self.opt.gamma
+            true_time_tensor = self.true_time.view(-1, 1).expand_as(self.fake_time)
+            self.loss_G_TPN = self.criterionL1(true_time_tensor, self.fake_time) * self.opt.gamma
             # combine loss and calculate gradients
-            self.loss_G = self.loss_G_GAN + self.loss_G_L1 + self.loss_G_TPN.to(self.device)
+            self.loss_G = self.loss_G_GAN + self.loss_G_L1 + self.loss_G_TPN
         else:
             # combine loss and calculate gradients
             self.loss_G = self.loss_G_GAN + self.loss_G_L1
 
-        self.loss_G.backward()
+        self.backward_loss(self.loss_G)
 
     def optimize_parameters(self):
         self.forward()                   # compute fake images: G(A)
         # update D
         self.set_requires_grad(self.netD, True)  # enable backprop for D
-        self.optimizer_D.zero_grad()     # set D's gradients to zero
+        self.zero_grad(self.optimizer_D)     # set D's gradients to zero
         self.backward_D()                # calculate gradients for D
-        self.optimizer_D.step()          # update D's weights
+        if self.accum_steps == 1:
+            self.step_optimizer(self.optimizer_D)  # update D's weights
         # update G
         self.set_requires_grad(self.netD, False)  # D requires no gradients when optimizing G
-        self.optimizer_G.zero_grad()        # set G's gradients to zero
+        self.zero_grad(self.optimizer_G)        # set G's gradients to zero
         self.backward_G()                   # calculate gradients for G
-        self.optimizer_G.step()             # udpate G's weights
+        self.step_optimizer(self.optimizer_G)  # udpate G's weights
+        if self.accum_steps > 1:  # all the G gradients of the window see the same D; step D after the last one
+            self.step_optimizer(self.optimizer_D)
 
     def update_current_gamma(self, epoch):
         ''' Update gamma value for TPN from opt, depending on the epoch '''
@@ -30,9 +30,12 @@ class Pix2PixModel(BaseModel):
         """
         # changing the default values to match the pix2pix paper (https://phillipi.github.io/pix2pix/)
         parser.set_defaults(norm='batch', netG='unet_256', dataset_mode='aligned')
+        parser.add_argument('--crop_foreground', action='store_true', help='run G on the bounding box of the non-zero content of each batch (rounded up to the sizes G accepts) and paste its output back. A U-Net only accepts its full size (256 px for unet_256), so on frames of that size G always runs on the full frame and only D is cropped (with --crop_loss crop)')
         if is_train:
             parser.set_defaults(pool_size=0, gan_mode='vanilla')
             parser.add_argument('--lambda_L1', type=float, default=100.0, help='weight for L1 loss')
+            parser.add_argument('--crop_loss', type=str, default='paste', help='with --crop_foreground, where D and the L1 loss run [paste: on the full frame | crop: on the bounding box]')
+            parser.add_argument('--split_D', action='store_true', help="split the first conv of the conditional D [basic | n_layers] by input channels: real_A's part is computed once per D update and reused, and [real_A, B] is never concatenated")
 
         return parser
 
@@ -45,6 +48,8 @@ class Pix2PixModel(BaseModel):
         BaseModel.__init__(self, opt)
         # specify the training losses you want to print out. The training/test scripts will call <BaseModel.get_current_losses>
         self.loss_names = ['G_GAN', 'G_L1', 'D_real', 'D_fake']
+        if self.isTrain and opt.lambda_gp > 0.0:
+            self.loss_names.append('D_GP')
         # specify the images you want to save/display. The training/test scripts will call <BaseModel.get_current_visuals>
         self.visual_names = ['real_A', 'fake_B', 'real_B']
         # specify the models you want to save to the disk. The training/test scripts will call <BaseModel.save_networks> and <BaseModel.load_networks>
@@ -55,20 +60,28 @@ class Pix2PixModel(BaseModel):
         # define networks (both generator and discriminator)
         self.netG = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.netG, opt.norm,
                                       not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids)
+        if self.isTrain and opt.checkpoint_G > 0:  # recompute generator activations in the backward pass
+            networks.set_checkpointing(self.netG, opt.checkpoint_G)
+        if opt.crop_foreground:
+            networks.check_foreground_crop(opt.netG, opt.crop_size)
 
         if self.isTrain:  # define a discriminator; conditional GANs need to take both input and output images; Therefore, #channels for D is input_nc + output_nc
             self.netD = networks.define_D(opt.input_nc + opt.output_nc, opt.ndf, opt.netD,
                                           opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
+            if opt.split_D:
+                assert opt.netD in ['basic', 'n_layers'], '--split_D needs a PatchGAN discriminator [basic | n_layers]'
 
         if self.isTrain:
             # define loss functions
             self.criterionGAN = networks.GANLoss(opt.gan_mode).to(self.device)
             self.criterionL1 = torch.nn.L1Loss()
             # initialize optimizers; schedulers will be automatically created by function <BaseModel.setup>.
-            self.optimizer_G = torch.optim.Adam(self.netG.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
-            self.optimizer_D = torch.optim.Adam(self.netD.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
+            self.optimizer_G = self.create_adam(self.netG.parameters())
+            self.optimizer_D = self.create_adam(self.netD.parameters())
             self.optimizers.append(self.optimizer_G)
             self.optimizers.append(self.optimizer_D)
+            if opt.compile:
+                self.compile_step(self.model_names)
 
     def set_input(self, input):
         """Unpack input data from the dataloader and perform necessary pre-processing steps.
@@ -79,49 +92,95 @@ class Pix2PixModel(BaseModel):
         The option 'direction' can be used to swap images in domain A and domain B.
         """
         AtoB = self.opt.direction == 'AtoB'
-        self.real_A = input['A' if AtoB else 'B'].to(self.device)
-        self.real_B = input['B' if AtoB else 'A'].to(self.device)
+        self.real_A = self.image_to_device(input['A' if AtoB else 'B'])
+        self.real_B = self.image_to_device(input['B' if AtoB else 'A'])
         self.image_paths = input['A_paths' if AtoB else 'B_paths']
+        if self.opt.crop_foreground:  # bounding box of the batch content for G, grown to the sizes D accepts for D
+            # training: the union with real_B keeps the L1 loss exact (see <l1_scale>); inference and validation
+            # (eval mode): real_A only, as the extent of the ground truth is unknown there
+            images = [self.real_A, self.real_B] if self.isTrain and self.netG.training else [self.real_A]
+            self.box_G = networks.foreground_box(images, *networks.size_multiple(self.opt.netG))
+            if self.isTrain and self.opt.crop_loss == 'crop':
+                self.box_D = networks.round_box(self.box_G, self.real_A.shape[2:], *networks.size_multiple(self.opt.netD, self.opt.n_layers_D))
 
     def forward(self):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
-        self.fake_B = self.netG(self.real_A)  # G(A)
+        if self.opt.crop_foreground:  # G(A) on the bounding box only, pasted back into an empty frame
+            self.fake_B = networks.paste_box(self.netG(networks.crop_box(self.real_A, self.box_G)), self.box_G, self.real_A.shape[2:])
+        else:
+            self.fake_B = self.netG(self.real_A)  # G(A)
+
+    def crop_D(self, image):
+        """Crop <image> to the region seen by D and the L1 loss (the full frame unless '--crop_loss crop')"""
+        if self.opt.crop_foreground and self.opt.crop_loss == 'crop':
+            return networks.crop_box(image, self.box_D)
+        return image
+
+    def l1_scale(self):
+        """Return the factor that makes an L1 loss on the <crop_D> region equal to the full-frame L1 loss.
+
+        The box contains G's box, which contains all non-background pixels of real_B, and G's output is background
+        outside its own box, so the pixels outside add nothing to the sum; only the mean's denominator changes.
+        """
+        if self.opt.crop_foreground and self.opt.crop_loss == 'crop':
+            y0, y1, x0, x1 = self.box_D
+            return float((y1 - y0) * (x1 - x0)) / (self.real_B.shape[2] * self.real_B.shape[3])
+        return 1.0
+
+    def discriminate(self, real_A, B, condition=None):
+        """Run the conditional discriminator on input real_A and output B.
+
+        With '--split_D', <condition> is D's first-layer response to real_A (from <networks.condition_D>), shared by
+        the calls made before D is updated, and only B goes through the first layer.
+        """
+        if condition is not None:
+            return self.netD(B, condition=condition)
+        return self.netD(torch.cat((real_A, B), 1))  # we use conditional GANs; we need to feed both input and output to the discriminator
+
+    def condition_D(self, real_A):
+        """Return the <condition> for <discriminate> with '--split_D' (computed with D's current weights), otherwise None"""
+        return networks.condition_D(self.netD, real_A) if self.opt.split_D else None
 
     def backward_D(self):
         """Calculate GAN loss for the discriminator"""
         # Fake; stop backprop to the generator by detaching fake_B
-        fake_AB = torch.cat((self.real_A, self.fake_B), 1)  # we use conditional GANs; we need to feed both input and output to the discriminator
-        pred_fake = self.netD(fake_AB.detach())
+        real_A, fake_B, real_B = self.crop_D(self.real_A), self.crop_D(self.fake_B), self.crop_D(self.real_B)
+        condition = self.condition_D(real_A)  # shared by the fake and real passes
+        pred_fake = self.discriminate(real_A, fake_B.detach(), condition)
         self.loss_D_fake = self.criterionGAN(pred_fake, False)
         # Real
-        real_AB = torch.cat((self.real_A, self.real_B), 1)
-        pred_real = self.netD(real_AB)
+        pred_real = self.discriminate(real_A, real_B, condition)
         self.loss_D_real = self.criterionGAN(pred_real, True)
+        # gradient penalty (if '--lambda_gp' > 0), on the same conditional inputs
+        self.loss_D_GP = self.gradient_penalty('D', torch.cat((real_A, real_B), 1), torch.cat((real_A, fake_B), 1))
         # combine loss and calculate gradients
-        self.loss_D = (self.loss_D_fake + self.loss_D_real) * 0.5
-        self.loss_D.backward()
+        self.loss_D = (self.loss_D_fake + self.loss_D_real) * 0.5 + self.loss_D_GP
+        self.backward_loss(self.loss_D)
 
     def backward_G(self):
         """Calculate GAN and L1 loss for the generator"""
         # First, G(A) should fake the discriminator
-        fake_AB = torch.cat((self.real_A, self.fake_B), 1)
-        pred_fake = self.netD(fake_AB)
+        real_A, fake_B, real_B = self.crop_D(self.real_A), self.crop_D(self.fake_B), self.crop_D(self.real_B)
+        pred_fake = self.discriminate(real_A, fake_B, self.condition_D(real_A))  # D has been updated since <backward_D>
         self.loss_G_GAN = self.criterionGAN(pred_fake, True)
         # Second, G(A) = B
-        self.loss_G_L1 = self.criterionL1(self.fake_B, self.real_B) * self.opt.lambda_L1
+        self.loss_G_L1 = self.criterionL1(fake_B, real_B) * self.opt.lambda_L1 * self.l1_scale()
         # combine loss and calculate gradients
         self.loss_G = self.loss_G_GAN + self.loss_G_L1
-        self.loss_G.backward()
+        self.backward_loss(self.loss_G)
 
     def optimize_parameters(self):
         self.forward()                   # compute fake images: G(A)
         # update D
         self.set_requires_grad(self.netD, True)  # enable backprop for D
-        self.optimizer_D.zero_grad()     # set D's gradients to zero
+        self.zero_grad(self.optimizer_D)     # set D's gradients to zero
         self.backward_D()                # calculate gradients for D
-        self.optimizer_D.step()          # update D's weights
+        if self.accum_steps == 1:
+            self.step_optimizer(self.optimizer_D)  # update D's weights
         # update G
         self.set_requires_grad(self.netD, False)  # D requires no gradients when optimizing G
-        self.optimizer_G.zero_grad()        # set G's gradients to zero
+        self.zero_grad(self.optimizer_G)        # set G's gradients to zero
         self.backward_G()                   # calculate graidents for G
-        self.optimizer_G.step()             # udpate G's weights
+        self.step_optimizer(self.optimizer_G)  # udpate G's weights
+        if self.accum_steps > 1:  # all the G gradients of the window see the same D; step D after the last one
+            self.step_optimizer(self.optimizer_D)
@@ -3,7 +3,6 @@ from .base_model import BaseModel
 from . import networks
 from copy import deepcopy
 from models import create_model
-import numpy as np
 
 
 class TimePredictorModel(BaseModel):
@@ -11,6 +10,7 @@ class TimePredictorModel(BaseModel):
 
     The model training requires '--dataset_mode brain' dataset.
     By default, it uses a '--netD time_input' discriminator,
+    '--netD time_input_pool' is a lighter variant that also trains on downsampled inputs, e.g. '--load_size 128 --crop_size 128'.
 
     """
     @staticmethod
@@ -29,6 +29,8 @@ class TimePredictorModel(BaseModel):
         """
         # changing the default values to match the pix2pix paper (https://phillipi.github.io/pix2pix/)
         parser.set_defaults(norm='batch', dataset_mode='aligned', netD='time_input')
+        parser.add_argument('--autoenc_name', type=str, default='autoenc_02', help='name of the trained auto_encoder experiment used by --netD time_autoenc')
+        parser.add_argument('--netAE', type=str, default='autoenc', help='architecture of that auto_encoder [autoenc | autoenc_conv]')
         if is_train:
             parser.set_defaults(pool_size=0, gan_mode='vanilla')
             parser.add_argument('--lambda_L1', type=float, default=100.0, help='weight for L1 loss')
@@ -49,30 +51,29 @@ class TimePredictorModel(BaseModel):
         # specify the models you want to save to the disk. The training/test scripts will call <BaseModel.save_networks> and <BaseModel.load_networks>
         self.model_names = ['D']
         # define network
-        # opt.netD can be ['time_input', 'time_diffmap', time_hist', 'time_autoenc']
-        self.Dtype = opt.netD
+        # opt.netD can be ['time_input', 'time_diffmap', time_hist', 'time_autoenc', 'time_input_pool', 'time_diffmap_pool']
+        # The '_pool' variants take the same inputs as their full-size counterparts, at any resolution
+        self.Dtype = opt.netD.replace('_pool', '')
         input_channel_size = opt.input_nc + opt.output_nc
 
         # These type of discriminators handle 1D data, so change
         # the corresponding sizes
-        if opt.netD == 'time_diffmap':
+        if self.Dtype == 'time_diffmap':
             input_channel_size = opt.input_nc
         if opt.netD == 'time_hist' or opt.netD == 'time_autoenc':
             opt.norm = 'batch_1d'
             input_channel_size = opt.input_nc
 
-        if opt.netD == 'time_autoenc':
+        # With '--dataset_mode latent' the autoencoder latent vectors are precomputed, so the encoder is not needed
+        self.use_latent_cache = opt.dataset_mode == 'latent'
+        if self.use_latent_cache:
+            assert opt.netD == 'time_autoenc', 'the latent dataset only provides inputs for --netD time_autoenc'
+            self.visual_names = []  # there are no images to display
+
+        if opt.netD == 'time_autoenc' and not self.use_latent_cache:
             # Setup Autoencoder if given in arguments
             print("\nSetting up AutoEncoder\n")
-            opt_autoenc = deepcopy(opt) # copy train options and change later
-            opt_autoenc.model = 'auto_encoder'
-            opt_autoenc.name = 'autoenc_02' # change to trained autoencoder model name
-            opt_autoenc.netD = 'autoenc'
-            opt_autoenc.norm = 'batch'
-            # hard-code some parameters for test
-            opt_autoenc.num_threads = 0   # test code only supports num_threads = 1
-            opt_autoenc.display_id = -1   # no visdom display; the test code saves the results to a HTML file.
-            opt_autoenc.isTrain = False
+            opt_autoenc = self.autoencoder_options(opt)
             print("Options Autoenc: {}\n\n".format(opt_autoenc))
             self.autoencoder = create_model(opt_autoenc)      # create a model given opt_autoenc.model and other options
             self.autoencoder.setup(opt_autoenc)               # regular setup: load
@@ -84,9 +85,23 @@ class TimePredictorModel(BaseModel):
             # define loss functions
             self.criterionL2 = torch.nn.MSELoss()
             # initialize optimizers; schedulers will be automatically created by function <BaseModel.setup>.
-            self.optimizer_D = torch.optim.Adam(self.netD.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
+            self.optimizer_D = self.create_adam(self.netD.parameters())
             self.optimizers.append(self.optimizer_D)
 
+    @staticmethod
+    def autoencoder_options(opt):
+        """Return the options of the frozen auto_encoder model used by '--netD time_autoenc'"""
+        opt_autoenc = deepcopy(opt) # copy train options and change later
+        opt_autoenc.model = 'auto_encoder'
+        opt_autoenc.name = opt.autoenc_name
+        opt_autoenc.netD = 'autoenc'
+        opt_autoenc.norm = 'batch'
+        # hard-code some parameters for test
+        opt_autoenc.num_threads = 0   # test code only supports num_threads = 1
+        opt_autoenc.display_id = -1   # no visdom display; the test code saves the results to a HTML file.
+        opt_autoenc.isTrain = False
+        return opt_autoenc
+
     def set_input(self, input):
         """Unpack input data from the dataloader and perform necessary pre-processing steps.
 
@@ -96,11 +111,14 @@ class TimePredictorModel(BaseModel):
         The option 'direction' can be used to swap images in domain A and domain B.
         """
         AtoB = self.opt.direction == 'AtoB'
-        self.real_A = input['A' if AtoB else 'B'].to(self.device)
-        self.real_B = input['B' if AtoB else 'A'].to(self.device)
-        self.diff_map = input['diff_map'].to(self.device)
-        self.hist_diff = input['hist_diff'].float().to(self.device)
-        self.true_time = input['time_period'][0]
+        if self.use_latent_cache:
+            self.latent = input['latent'].to(self.device)
+        else:
+            self.real_A = self.image_to_device(input['A' if AtoB else 'B'])
+            self.real_B = self.image_to_device(input['B' if AtoB else 'A'])
+            self.diff_map = self.image_to_device(input['diff_map'])
+            self.hist_diff = input['hist_diff'].float().to(self.device)
+        self.true_time = input['time_period'].float().to(self.device)  # one time period per sample, shape [N]
         self.image_paths = input['A_paths' if AtoB else 'B_paths']
 
     def forward(self):
@@ -112,23 +130,30 @@ class TimePredictorModel(BaseModel):
             self.prediction = self.netD(self.diff_map)
         elif self.Dtype == 'time_hist':
             self.prediction = self.netD(self.hist_diff)
+        elif self.Dtype == 'time_autoenc' and self.use_latent_cache:
+            self.prediction = self.netD(self.latent)
         elif self.Dtype == 'time_autoenc':
             self.autoencoder.diff_map = self.diff_map # Bypass Input and just store the diff map in the object
             latent_vector = self.autoencoder.forward_getVector() 
-            self.prediction = self.netD(latent_vector[np.newaxis, :])
+            self.prediction = self.netD(latent_vector)
+
+    def validation_metric(self):
+        """Return the L1 error of each sample's predicted time period (its prediction averaged, as in <evaluate_time>)"""
+        prediction = self.prediction.float().reshape(len(self.true_time), -1).mean(1)
+        return (prediction - self.true_time).abs()
 
     def backward_D(self):
         # Calculate Loss for D
-        # Store scalar in a 1x1 matrix so that we can use it for the loss
-        true_time_tensor = torch.ones(self.prediction.shape) * self.true_time
-        self.loss_D_real = self.criterionL2(true_time_tensor, self.prediction.cpu())
+        # Broadcast each sample's time period over its prediction so that we can use it for the loss
+        true_time_tensor = self.true_time.view((-1,) + (1,) * (self.prediction.dim() - 1)).expand_as(self.prediction)
+        self.loss_D_real = self.criterionL2(true_time_tensor, self.prediction)
         self.loss_D = self.loss_D_real
-        self.loss_D.backward()
+        self.backward_loss(self.loss_D)
 
     def optimize_parameters(self):
         self.forward()                   # compute fake images: G(A)
         # update D
         self.set_requires_grad(self.netD, True)  # enable backprop for D
-        self.optimizer_D.zero_grad()     # set D's gradients to zero
+        self.zero_grad(self.optimizer_D)     # set D's gradients to zero
         self.backward_D()                # calculate gradients for D
-        self.optimizer_D.step()          # update D's weights
+        self.step_optimizer(self.optimizer_D)  # update D's weights
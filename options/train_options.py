@@ -31,10 +31,31 @@ class TrainOptions(BaseOptions):
         parser.add_argument('--niter_decay', type=int, default=100, help='# of iter to linearly decay learning rate to zero')
         parser.add_argument('--beta1', type=float, default=0.5, help='momentum term of adam')
         parser.add_argument('--lr', type=float, default=0.0002, help='initial learning rate for adam')
+        parser.add_argument('--progressive_sizes', type=str, default='', help='progressive resolution: crop sizes of the training stages, e.g. 64,128,256; the load size is scaled with the crop size')
+        parser.add_argument('--progressive_epochs', type=str, default='', help='first epoch of each stage of --progressive_sizes, e.g. 1,20,40')
+        parser.add_argument('--accum_steps', type=int, default=1, help='accumulate the gradients of <accum_steps> batches before each update, for an effective batch size of batch_size * accum_steps')
+        parser.add_argument('--lean_step', action='store_true', help='after each step, drop the output images and loss graphs kept by the model; keep downsampled visuals only on display steps')
+        parser.add_argument('--compile', action='store_true', help='cycle_gan and pix2pix: compile the G and D forward passes and the GAN loss with torch.compile (falls back to eager execution per network if that fails); single GPU or CPU only')
+        parser.add_argument('--intra_threads', type=int, default=0, help='# of intra-op threads (torch.set_num_threads), set once when the options are parsed; 0 keeps the default. Every thread running ops uses this many, so with cycle_gan --fork_branches the two branches use twice as many')
+        parser.add_argument('--adam_impl', type=str, default='auto', help='implementation of the adam update [auto | fused | foreach | for_loop]. auto: fused on a GPU, foreach on the CPU')
         parser.add_argument('--gan_mode', type=str, default='lsgan', help='the type of GAN objective. [vanilla| lsgan | wgangp]. vanilla GAN loss is the cross-entropy objective used in the original GAN paper.')
+        parser.add_argument('--lambda_gp', type=float, default=0.0, help='cycle_gan and pix2pix: weight of the gradient penalty on D (see --gp_type); 0 disables it')
+        parser.add_argument('--gp_type', type=str, default='wgangp', help='gradient penalty [wgangp: (||grad D(mix of real and fake)|| - 1)^2 | r1: ||grad D(real)||^2 / 2]')
+        parser.add_argument('--gp_every', type=int, default=1, help='lazy regularization: apply the gradient penalty every <gp_every> D updates, with its weight multiplied by <gp_every>')
         parser.add_argument('--pool_size', type=int, default=50, help='the size of image buffer that stores previously generated images')
+        parser.add_argument('--pool_on_host', action='store_true', help='keep the image buffer in pinned host memory instead of GPU memory (for large crops)')
+        parser.add_argument('--pool_seed', type=int, default=-1, help='seed of the image buffer draws; -1 uses the global random generator')
         parser.add_argument('--lr_policy', type=str, default='linear', help='learning rate policy. [linear | step | plateau | cosine]')
         parser.add_argument('--lr_decay_iters', type=int, default=50, help='multiply by a gamma every lr_decay_iters iterations')
+        parser.add_argument('--checkpoint_G', type=int, default=0, help='gradient checkpointing of the generator to save activation memory: checkpoint every <checkpoint_G>-th U-Net level, or groups of <checkpoint_G> ResNet blocks; 0 disables it')
+        # evaluation parameters
+        parser.add_argument('--eval_epoch_freq', type=int, default=1, help='evaluate every <eval_epoch_freq> epochs; <= 0 disables the epoch trigger')
+        parser.add_argument('--eval_time_freq', type=float, default=0, help='also evaluate once <eval_time_freq> seconds have passed since the last evaluation; 0 disables the time trigger')
+        parser.add_argument('--num_eval', type=int, default=200, help='# of samples used per evaluation')
+        parser.add_argument('--eval_batch_size', type=int, default=16, help='batch size of the evaluation pass')
+        parser.add_argument('--val_phase', type=str, default='', help='train.py: validate on the first <num_eval> samples of this phase (e.g. val) every <val_epoch_freq> epochs; the metric drives --lr_policy plateau, early stopping and the best checkpoint. empty disables validation')
+        parser.add_argument('--val_epoch_freq', type=int, default=1, help='validate every <val_epoch_freq> epochs (with --val_phase)')
+        parser.add_argument('--early_stop', type=int, default=0, help='stop training once the validation metric has not improved for <early_stop> validations; 0 disables early stopping')
 
         self.isTrain = True
         return parser
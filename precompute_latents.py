@@ -0,0 +1,23 @@
+"""Precompute the autoencoder latent vectors used by the Time Predictor Network with '--netD time_autoenc'.
+
+It encodes every diff map of the '--phase' split once with the trained autoencoder ('--autoenc_name') and stores
+the latent vectors and time labels in checkpoints/<autoenc_name>/latent_cache_<phase>.npz.
+Training and testing with '--dataset_mode latent' then read this cache instead of decoding and encoding images.
+The cache is rebuilt automatically (also by the latent dataset) when the autoencoder checkpoint changes.
+
+Example:
+    Build the caches, then train the time predictor on them:
+        python precompute_latents.py --dataroot #DATASET_LOCATION# --name #EXP_NAME# --model time_predictor --autoenc_name autoenc_02 --input_nc 1 --output_nc 1 --phase train
+        python precompute_latents.py --dataroot #DATASET_LOCATION# --name #EXP_NAME# --model time_predictor --autoenc_name autoenc_02 --input_nc 1 --output_nc 1 --phase val
+        python train_time.py --dataroot #DATASET_LOCATION# --name #EXP_NAME# --model time_predictor --netD time_autoenc --dataset_mode latent --batch_size 1024
+
+See options/base_options.py and options/test_options.py for more options.
+"""
+from options.test_options import TestOptions
+from util.latent_cache import build_latent_cache
+
+
+if __name__ == '__main__':
+    opt = TestOptions().parse()  # get test options
+    opt.netD = 'time_autoenc'
+    build_latent_cache(opt)
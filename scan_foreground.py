@@ -0,0 +1,38 @@
+"""Build the foreground index of a paired brain slice dataset.
+
+For every {A,B} image pair in <dataroot>/<phase> it records the fraction of non-zero pixels and the bounding box of the
+non-zero content, and writes them to <dataroot>/<phase>_foreground.csv (see data/foreground_index.py).
+It then reports, for a few thresholds, how many slices '--min_foreground' would skip. Training and testing cost is
+roughly the same for every slice, so the share of skipped slices is also the share of per-epoch time saved.
+
+Example:
+    Index the train and test splits, then train on the slices with at least 5% non-zero pixels:
+        python scan_foreground.py --dataroot #DATASET_LOCATION# --phases train test
+        python train.py --dataroot #DATASET_LOCATION# --name #EXP_NAME# --model pix2pix_brain --dataset_mode brain --min_foreground 0.05
+"""
+import os
+import argparse
+from data.image_folder import make_dataset
+from data import foreground_index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders train, test, etc)')
+    parser.add_argument('--phases', type=str, nargs='+', default=['train', 'val', 'test'], help='dataset splits to index; missing ones are skipped')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.01, 0.05, 0.1, 0.2], help='--min_foreground values to report')
+    args = parser.parse_args()
+
+    for phase in args.phases:
+        dir_AB = os.path.join(args.dataroot, phase)
+        if not os.path.isdir(dir_AB):
+            continue
+        paths = sorted(make_dataset(dir_AB))
+        filename = foreground_index.index_path(args.dataroot, phase)
+        foreground_index.write_index(paths, filename)
+        fractions = [fraction for fraction, _ in foreground_index.read_index(filename).values()]
+        print('saved the foreground index of %d slices to %s' % (len(fractions), filename))
+        print('%-16s %14s %14s' % ('min_foreground', 'slices kept', 'epoch time saved'))
+        for threshold in args.thresholds:
+            kept = sum(fraction >= threshold for fraction in fractions)
+            print('%-16g %8d/%-5d %13.1f%%' % (threshold, kept, len(fractions), 100.0 * (len(fractions) - kept) / max(len(fractions), 1)))
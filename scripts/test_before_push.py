@@ -34,6 +34,8 @@ if __name__ == '__main__':
     # cyclegan train/test
     run('python train.py --model cycle_gan --name temp_cyclegan --dataroot ./datasets/mini --niter 1 --niter_decay 0 --save_latest_freq 10  --print_freq 1 --display_id -1')
     run('python test.py --model test --name temp_cyclegan --dataroot ./datasets/mini --num_test 1 --model_suffix "_A" --no_dropout')
+    # cyclegan across a resolution change of the progressive schedule (the image pools are reallocated)
+    run('python train.py --model cycle_gan --name temp_cyclegan_progressive --dataroot ./datasets/mini --niter 2 --niter_decay 0 --progressive_sizes 64,128 --progressive_epochs 1,2 --save_latest_freq 10 --print_freq 1 --display_id -1')
 
     # pix2pix train/test
     run('python train.py --model pix2pix --name temp_pix2pix --dataroot ./datasets/mini_pix2pix --niter 1 --niter_decay 5 --save_latest_freq 10 --display_id -1')
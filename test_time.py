@@ -4,7 +4,7 @@ Once you have trained your model with train_time.py, you can use this script to
 It will load a saved model from --checkpoints_dir and print out the results.
 
 It first creates model and dataset given the option. It will hard-code some parameters.
-It then runs inference for --num_test images and prints out the results.
+It then runs inference for --num_test images (in batches of --batch_size) and prints out the results.
 
 Example (You need to train models first:
     Test a TimePredictoNetwork model:
@@ -30,16 +30,21 @@ def predict_time(opt=None, dataset=None, model=None):
         model = create_model(opt)      # create a model given opt.model and other options
         model.setup(opt)               # regular setup: load and print networks; create schedulers
 
-    # Create matrix to hold predictions:
-    predictions = torch.zeros(min(opt.num_test, len(dataset)))
-    true_times = torch.zeros(len(predictions))
+    # Collect one prediction per sample, a batch at a time
+    predictions = []
+    true_times = []
+    num_samples = 0
     for i, data in enumerate(dataset):
-        if i >= opt.num_test:  # only apply our model to opt.num_test images.
+        if num_samples >= opt.num_test:  # only apply our model to opt.num_test images.
             break
         model.set_input(data)  # unpack data from data loader
         model.test()           # run inference
-        predictions[i] = torch.mean(model.prediction).item()
-        true_times[i] = model.true_time
+        batch_size = len(model.true_time)
+        predictions.append(model.prediction.reshape(batch_size, -1).mean(1))
+        true_times.append(model.true_time)
+        num_samples += batch_size
+    predictions = torch.cat(predictions)[:opt.num_test].cpu()
+    true_times = torch.cat(true_times)[:opt.num_test].cpu()
 
     L1 = torch.nn.L1Loss()
     MSE = torch.nn.MSELoss()
@@ -50,11 +55,35 @@ def predict_time(opt=None, dataset=None, model=None):
 
     return predictions, true_times
 
+def evaluate_time(model, dataset, num_test):
+    """Return the mean L1 and MSE of the time predictions over the first <num_test> samples of <dataset>.
+
+    The model runs in eval mode under torch.no_grad and is put back in train mode afterwards.
+    The errors are accumulated on the model device, so there is a single host sync at the end.
+    """
+    model.eval()
+    errors = torch.zeros(2, device=model.device)  # sum of absolute errors, sum of squared errors
+    num_samples = 0
+    with torch.no_grad():
+        for data in dataset:
+            if num_samples >= num_test:
+                break
+            model.set_input(data)
+            model.forward()
+            n = min(len(model.true_time), num_test - num_samples)
+            prediction = model.prediction.reshape(len(model.true_time), -1).mean(1)[:n]
+            error = prediction - model.true_time[:n]
+            errors += torch.stack([error.abs().sum(), error.pow(2).sum()])
+            num_samples += n
+    model.train()
+    loss_l1, loss_mse = (errors / max(num_samples, 1)).tolist()
+    return loss_l1, loss_mse
+
+
 if __name__ == '__main__':
     opt = TestOptions().parse()  # get test options
     # hard-code some parameters for test
     opt.num_threads = 0   # test code only supports num_threads = 1
-    opt.batch_size = 1    # test code only supports batch_size = 1
     opt.serial_batches = True  # disable data shuffling; comment this line if results on randomly chosen images are needed.
     opt.no_flip = True    # no flip; comment this line if results on flipped images are needed.
     opt.display_id = -1   # no visdom display; the test code saves the results to a HTML file.
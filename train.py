@@ -6,7 +6,10 @@ You need to specify the dataset ('--dataroot'), experiment name ('--name'), and
 
 It first creates model, dataset, and visualizer given the option.
 It then does standard network training. During the training, it also visualize/save the images, print/save the loss plot, and save models.
+With '--val_phase', it validates the model every <val_epoch_freq> epochs, feeds the metric to '--lr_policy plateau',
+keeps the best model as the 'best' checkpoint, and stops early after '--early_stop' validations without improvement.
 The script supports continue/resume training. Use '--continue_train' to resume your previous training.
+On resume, the metric of the 'best' checkpoint is read back from [checkpoints_dir]/[name]/best_metric.txt.
 
 Example:
     Train a CycleGAN model:
@@ -18,14 +21,36 @@ See options/base_options.py and options/train_options.py for more training optio
 See training and test tips at: https://github.com/junyanz/pytorch-CycleGAN-and-pix2pix/blob/master/docs/tips.md
 See frequently asked questions at: https://github.com/junyanz/pytorch-CycleGAN-and-pix2pix/blob/master/docs/qa.md
 """
+import os
 import time
 from options.train_options import TrainOptions
-from data import create_dataset
+from data import create_dataset, create_eval_dataset
 from models import create_model
 from util.visualizer import Visualizer
+from util import progressive
+
+
+def best_metric_path(opt):
+    """Return the path of the file that records the validation metric of the 'best' checkpoint"""
+    return os.path.join(opt.checkpoints_dir, opt.name, 'best_metric.txt')
+
+
+def load_best_metric(opt):
+    """Return the recorded metric of the 'best' checkpoint when resuming ('--continue_train'), or inf"""
+    if not opt.continue_train or not os.path.exists(best_metric_path(opt)):
+        return float('inf')
+    with open(best_metric_path(opt)) as best_file:
+        return float(best_file.read().split()[0])
+
 
 if __name__ == '__main__':
     opt = TrainOptions().parse()   # get training options
+    # validation set at the full crop size, also with '--progressive_sizes', so the metric is comparable across stages
+    dataset_val = create_eval_dataset(opt, opt.val_phase) if opt.val_phase else None
+    if opt.lr_policy == 'plateau' and dataset_val is None:
+        print('warning: --lr_policy plateau without --val_phase never changes the learning rate')
+    schedule = progressive.parse_schedule(opt)  # crop sizes per epoch with '--progressive_sizes'; [] otherwise
+    progressive.apply_stage(opt, schedule, opt.epoch_count)
     dataset = create_dataset(opt)  # create a dataset given opt.dataset_mode and other options
     dataset_size = len(dataset)    # get the number of images in the dataset.
     print('The number of training images = %d' % dataset_size)
@@ -34,8 +59,16 @@ if __name__ == '__main__':
     model.setup(opt)               # regular setup: load and print networks; create schedulers
     visualizer = Visualizer(opt)   # create a visualizer that display/save images and plots
     total_iters = 0                # the total number of training iterations
+    train_start_time = time.time()  # timer for the whole run; reported at the stages of '--progressive_sizes'
+    micro_times = []               # computation time of each (micro-)batch since the last print, see '--accum_steps'
+    best_metric = load_best_metric(opt)  # best validation metric so far, see '--val_phase'
+    bad_validations = 0            # validations since the best one, see '--early_stop'
 
     for epoch in range(opt.epoch_count, opt.niter + opt.niter_decay + 1):    # outer loop for different epochs; we save the model by <epoch_count>, <epoch_count>+<save_latest_freq>
+        if progressive.apply_stage(opt, schedule, epoch):  # new resolution stage: rebuild the transforms and the DataLoader
+            dataset = create_dataset(opt)
+            dataset_size = len(dataset)
+            print('epoch %d: training at crop size %d (load size %d) after %d sec' % (epoch, opt.crop_size, opt.load_size, time.time() - train_start_time))
         epoch_start_time = time.time()  # timer for entire epoch
         iter_data_time = time.time()    # timer for data loading per iteration
         epoch_iter = 0                  # the number of training iterations in current epoch, reset to 0 every epoch
@@ -48,17 +81,22 @@ if __name__ == '__main__':
             total_iters += opt.batch_size
             epoch_iter += opt.batch_size
             model.set_input(data)         # unpack data from dataset and apply preprocessing
-            model.optimize_parameters()   # calculate loss functions, get gradients, update network weights
+            model.train_step()            # calculate loss functions, get gradients, update network weights (every <accum_steps> batches)
+            micro_times.append(time.time() - iter_start_time)
+            if opt.lean_step:             # release the step's tensors; keep small visuals for a display step
+                model.release_step(keep_visuals=total_iters % opt.display_freq == 0)
 
             if total_iters % opt.display_freq == 0:   # display images on visdom and save images to a HTML file
                 save_result = total_iters % opt.update_html_freq == 0
-                model.compute_visuals()
+                if not opt.lean_step:     # <release_step> has computed them
+                    model.compute_visuals()
                 visualizer.display_current_results(model.get_current_visuals(), epoch, save_result)
 
             if total_iters % opt.print_freq == 0:    # print training losses and save logging information to the disk
                 losses = model.get_current_losses()
                 t_comp = (time.time() - iter_start_time) / opt.batch_size
-                visualizer.print_current_losses(epoch, epoch_iter, losses, t_comp, t_data)
+                visualizer.print_current_losses(epoch, epoch_iter, losses, t_comp, t_data, micro_times if opt.accum_steps > 1 else None)
+                micro_times = []
                 if opt.display_id > 0:
                     visualizer.plot_current_losses(epoch, float(epoch_iter) / dataset_size, losses)
 
@@ -73,10 +111,28 @@ if __name__ == '__main__':
             model.save_networks('latest')
             model.save_networks(epoch)
 
-        print('End of epoch %d / %d \t Time Taken: %d sec' % (epoch, opt.niter + opt.niter_decay, time.time() - epoch_start_time))
-        model.update_learning_rate()                     # update learning rates at the end of every epoch.
+        print('End of epoch %d / %d \t Time Taken: %d sec \t Total: %d sec' % (epoch, opt.niter + opt.niter_decay, time.time() - epoch_start_time, time.time() - train_start_time))
+
+        last_epoch = epoch == opt.niter + opt.niter_decay
+        if dataset_val is not None and (epoch % opt.val_epoch_freq == 0 or last_epoch):  # validate; the metric drives the plateau policy
+            model.metric = model.validate(dataset_val, opt.num_eval)
+            if model.metric < best_metric:
+                best_metric, bad_validations = model.metric, 0
+                print('saving the best model (epoch %d, total_iters %d)' % (epoch, total_iters))
+                model.save_networks('best')
+                with open(best_metric_path(opt), 'w') as best_file:
+                    best_file.write('%r %d\n' % (best_metric, epoch))
+            else:
+                bad_validations += 1
+            print('validation metric on %s: %.5f (best: %.5f, %d validations without improvement)' % (opt.val_phase, model.metric, best_metric, bad_validations))
+        model.update_learning_rate()                     # update learning rates at the end of every epoch (plateau: after a validation only).
         
         # If TPN is enabled, call the gamma scheduler to update
         # the hyperparameter value at every epoch
         if opt.model == 'pix2pix_brain' and opt.TPN:
             model.update_current_gamma(epoch)
+
+        if opt.early_stop > 0 and bad_validations >= opt.early_stop:  # no improvement in the last <early_stop> validations
+            print('early stopping at the end of epoch %d, iters %d; the best model is saved as best' % (epoch, total_iters))
+            model.save_networks('latest')
+            break
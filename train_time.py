@@ -3,6 +3,8 @@ This is an altered version of the original train.py script
 
 It first creates model, dataset.
 It then does standard network training. During the training, it print/save the loss plot, and save models.
+Every <eval_epoch_freq> epochs (or <eval_time_freq> seconds), it evaluates the L1/MSE of the predicted time on the first
+<num_eval> training and validation samples, and appends them to [checkpoints_dir]/[name]/eval_log.csv.
 The script supports continue/resume training. Use '--continue_train' to resume your previous training.
 
 Example:
@@ -13,29 +15,29 @@ See options/base_options.py and options/train_options.py for more training optio
 See training and test tips at: https://github.com/junyanz/pytorch-CycleGAN-and-pix2pix/blob/master/docs/tips.md
 See frequently asked questions at: https://github.com/junyanz/pytorch-CycleGAN-and-pix2pix/blob/master/docs/qa.md
 """
+import os
+import csv
 import time
 from options.train_options import TrainOptions
-from data import create_dataset
+from data import create_dataset, create_eval_dataset
 from models import create_model
 from util.visualizer import Visualizer
-from test_time import predict_time
+from test_time import evaluate_time
+
 
 if __name__ == '__main__':
     opt = TrainOptions().parse()   # get training options
 
     # Create additional train and val datasets to check
-    # accuracy at every epoch
-    test_opt_train = TrainOptions().parse() 
-    test_opt_val = TrainOptions().parse() 
-    NUM_TEST = 200
-    test_opt_train.isTrain = False
-    test_opt_val.isTrain = False
-    test_opt_train.num_test = NUM_TEST
-    test_opt_val.num_test = NUM_TEST
-    test_opt_val.phase = 'val'
-
+    # accuracy during training
     dataset = create_dataset(opt)  # create a dataset given opt.dataset_mode and other options
-    dataset_val = create_dataset(test_opt_val)  # create a dataset given opt.dataset_mode and other options
+    dataset_eval_train = create_eval_dataset(opt, opt.phase)
+    dataset_eval_val = create_eval_dataset(opt, 'val')
+    eval_log_name = os.path.join(opt.checkpoints_dir, opt.name, 'eval_log.csv')
+    if not os.path.exists(eval_log_name):
+        with open(eval_log_name, 'w') as eval_log:
+            csv.writer(eval_log).writerow(['epoch', 'total_iters', 'train_L1', 'train_MSE', 'val_L1', 'val_MSE', 'eval_time'])
+    last_eval_time = time.time()
     dataset_size = len(dataset)    # get the number of images in the dataset.
     print('The number of training images = %d' % dataset_size)
 
@@ -43,6 +45,7 @@ if __name__ == '__main__':
     model.setup(opt)               # regular setup: load and print networks; create schedulers
     visualizer = Visualizer(opt)   # create a visualizer that display/save images and plots
     total_iters = 0                # the total number of training iterations
+    micro_times = []               # computation time of each (micro-)batch since the last print, see '--accum_steps'
 
     print("Using netD:", opt.netD)
 
@@ -59,17 +62,22 @@ if __name__ == '__main__':
             total_iters += opt.batch_size
             epoch_iter += opt.batch_size
             model.set_input(data)         # unpack data from dataset and apply preprocessing
-            model.optimize_parameters()   # calculate loss functions, get gradients, update network weights
+            model.train_step()            # calculate loss functions, get gradients, update network weights (every <accum_steps> batches)
+            micro_times.append(time.time() - iter_start_time)
+            if opt.lean_step:             # release the step's tensors; keep small visuals for a display step
+                model.release_step(keep_visuals=total_iters % opt.display_freq == 0)
 
             if total_iters % opt.display_freq == 0:   # display images on visdom and save images to a HTML file
                 save_result = total_iters % opt.update_html_freq == 0
-                model.compute_visuals()
+                if not opt.lean_step:     # <release_step> has computed them
+                    model.compute_visuals()
                 visualizer.display_current_results(model.get_current_visuals(), epoch, save_result)
 
             if total_iters % opt.print_freq == 0:    # print training losses and save logging information to the disk
                 losses = model.get_current_losses()
                 t_comp = (time.time() - iter_start_time) / opt.batch_size
-                visualizer.print_current_losses(epoch, epoch_iter, losses, t_comp, t_data)
+                visualizer.print_current_losses(epoch, epoch_iter, losses, t_comp, t_data, micro_times if opt.accum_steps > 1 else None)
+                micro_times = []
                 if opt.display_id > 0:
                     visualizer.plot_current_losses(epoch, float(epoch_iter) / dataset_size, losses)
 
@@ -86,8 +94,18 @@ if __name__ == '__main__':
 
         print('End of epoch %d / %d \t Time Taken: %d sec' % (epoch, opt.niter + opt.niter_decay, time.time() - epoch_start_time))
         
-        # Print Error for Training Set and Validation Set:
-        predict_time(test_opt_train, dataset, model)
-        predict_time(test_opt_val, dataset_val, model)
+        # Evaluate the error on the Training Set and Validation Set
+        last_epoch = epoch == opt.niter + opt.niter_decay
+        by_epoch = opt.eval_epoch_freq > 0 and epoch % opt.eval_epoch_freq == 0
+        by_time = opt.eval_time_freq > 0 and time.time() - last_eval_time >= opt.eval_time_freq
+        if by_epoch or by_time or last_epoch:
+            eval_start_time = time.time()
+            train_l1, train_mse = evaluate_time(model, dataset_eval_train, opt.num_eval)
+            val_l1, val_mse = evaluate_time(model, dataset_eval_val, opt.num_eval)
+            last_eval_time = time.time()
+            print("Loss for train set: L1: {}, MSE: {}".format(train_l1, train_mse))
+            print("Loss for val set: L1: {}, MSE: {}".format(val_l1, val_mse))
+            with open(eval_log_name, 'a') as eval_log:
+                csv.writer(eval_log).writerow([epoch, total_iters, train_l1, train_mse, val_l1, val_mse, last_eval_time - eval_start_time])
 
         model.update_learning_rate()                     # update learning rates at the end of every epoch.
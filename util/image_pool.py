@@ -1,4 +1,3 @@
-import random
 import torch
 
 
@@ -7,18 +6,36 @@ class ImagePool():
 
     This buffer enables us to update discriminators using a history of generated images
     rather than the ones produced by the latest generators.
+
+    The images are kept in one preallocated [pool_size, C, H, W] tensor (allocated at the first query), and each query
+    is a handful of batched tensor operations, without per-image Python work or synchronization with the GPU.
+    When the image size changes (e.g. at a stage of '--progressive_sizes'), the pool is emptied and allocated again.
     """
 
-    def __init__(self, pool_size):
+    def __init__(self, pool_size, generator=None, pin_memory=False):
         """Initialize the ImagePool class
 
         Parameters:
-            pool_size (int) -- the size of image buffer, if pool_size=0, no buffer will be created
+            pool_size (int)             -- the size of image buffer, if pool_size=0, no buffer will be created
+            generator (torch.Generator) -- random number generator for the pool's draws, on the device where the pool
+                                           is stored; if None, the default generator of that device is used
+            pin_memory (bool)           -- store the pool in pinned host memory instead of on the images' device,
+                                           which saves GPU memory with large crops at the cost of host-device copies
         """
         self.pool_size = pool_size
+        self.generator = generator
+        self.pin_memory = pin_memory
         if self.pool_size > 0:  # create an empty pool
             self.num_imgs = 0
-            self.images = []
+            self.images = None
+
+    def allocate(self, images):
+        """Allocate an empty buffer for images shaped like <images> (a batch)"""
+        self.num_imgs = 0
+        if self.pin_memory:
+            self.images = torch.empty((self.pool_size,) + images.shape[1:], dtype=images.dtype).pin_memory()
+        else:
+            self.images = torch.empty((self.pool_size,) + images.shape[1:], dtype=images.dtype, device=images.device)
 
     def query(self, images):
         """Return an image from the pool.
@@ -31,24 +48,35 @@ class ImagePool():
         By 50/100, the buffer will return input images.
         By 50/100, the buffer will return images previously stored in the buffer,
         and insert the current images to the buffer.
+
+        The coin flips of a batch are drawn together as a Bernoulli mask, and the images that are swapped go to
+        distinct random slots (with <index_copy_>), so an image inserted by this query is not returned by it.
+        Batches larger than the pool are processed in rounds of <pool_size> images.
         """
         if self.pool_size == 0:  # if the buffer size is 0, do nothing
             return images
+        images = images.detach()
+        if self.images is None or images.shape[1:] != self.images.shape[1:]:  # first query, or a new image size
+            self.allocate(images)
         return_images = []
-        for image in images:
-            image = torch.unsqueeze(image.data, 0)
-            if self.num_imgs < self.pool_size:   # if the buffer is not full; keep inserting current images to the buffer
-                self.num_imgs = self.num_imgs + 1
-                self.images.append(image)
-                return_images.append(image)
-            else:
-                p = random.uniform(0, 1)
-                if p > 0.5:  # by 50% chance, the buffer will return a previously stored image, and insert the current image into the buffer
-                    random_id = random.randint(0, self.pool_size - 1)  # randint is inclusive
-                    tmp = self.images[random_id].clone()
-                    self.images[random_id] = image
-                    return_images.append(tmp)
-                else:       # by another 50% chance, the buffer will return the current image
-                    return_images.append(image)
-        return_images = torch.cat(return_images, 0)   # collect all the images and return
-        return return_images
+        if self.num_imgs < self.pool_size:   # if the buffer is not full; keep inserting current images to the buffer
+            n = min(self.pool_size - self.num_imgs, images.size(0))
+            self.images[self.num_imgs:self.num_imgs + n].copy_(images[:n])
+            self.num_imgs = self.num_imgs + n
+            return_images.append(images[:n])
+            images = images[n:]
+        for start in range(0, images.size(0), self.pool_size):
+            return_images.append(self.swap(images[start:start + self.pool_size]))
+        return torch.cat(return_images, 0) if len(return_images) > 1 else return_images[0]
+
+    def swap(self, images):
+        """Swap each of <images> (at most <pool_size>) with a stored image by 50% chance; return the resulting batch"""
+        storage = self.images.device
+        n = images.size(0)
+        swapped = torch.rand(n, generator=self.generator, device=storage) < 0.5
+        slots = torch.randperm(self.pool_size, generator=self.generator, device=storage)[:n]  # distinct random slots
+        stored = self.images.index_select(0, slots)
+        mask = swapped.view(-1, *([1] * (images.dim() - 1)))
+        # the returned image is the stored one where swapped; the slot keeps its image otherwise
+        self.images.index_copy_(0, slots, torch.where(mask, images.to(storage, self.images.dtype), stored))
+        return torch.where(mask.to(images.device, non_blocking=True), stored.to(images.device, images.dtype, non_blocking=True), images)
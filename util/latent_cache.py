@@ -0,0 +1,90 @@
+"""This module builds and loads the on-disk cache of autoencoder latent vectors used by '--netD time_autoenc'.
+
+The autoencoder is frozen while the time predictor trains, so encoding every diff map again in every epoch is wasted work.
+The cache stores one latent vector and one time label per brain slice in a single .npz file under the autoencoder's checkpoint
+directory, together with a fingerprint of the autoencoder checkpoint. The cache is rebuilt whenever that checkpoint changes.
+"""
+import os
+import hashlib
+from copy import deepcopy
+import numpy as np
+
+
+def checkpoint_path(opt):
+    """Return the path of the autoencoder checkpoint that the time predictor loads"""
+    load_suffix = 'iter_%d' % opt.load_iter if opt.load_iter > 0 else opt.epoch
+    return os.path.join(opt.checkpoints_dir, opt.autoenc_name, '%s_net_AE.pth' % load_suffix)
+
+
+def cache_path(opt):
+    """Return the path of the latent cache for the dataset split <opt.phase>"""
+    return os.path.join(opt.checkpoints_dir, opt.autoenc_name, 'latent_cache_%s.npz' % opt.phase)
+
+
+def fingerprint(path):
+    """Return a SHA-1 digest of the file at <path>, used to detect a changed autoencoder checkpoint"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def build_latent_cache(opt):
+    """Encode every diff map of the brain dataset once and save the latent vectors to <cache_path>.
+
+    Parameters:
+        opt (Option class) -- time_predictor options; uses dataroot, phase, autoenc_name, checkpoints_dir and the image options
+
+    The diff maps are loaded without random augmentation (no flip, rotation or random crop), because a cached latent vector
+    must not depend on the epoch. Each diff map is encoded on its own, exactly as <TimePredictorModel.forward> does,
+    so the cached vectors match the ones computed on the fly.
+    """
+    from data import create_dataset
+    from models import create_model
+    from models.time_predictor_model import TimePredictorModel
+
+    opt_data = deepcopy(opt)
+    opt_data.dataset_mode = 'brain'
+    opt_data.batch_size = 1
+    opt_data.serial_batches = True
+    opt_data.no_flip = True
+    opt_data.rotate = None
+    opt_data.load_size = opt.crop_size  # no random crop
+    opt_data.max_dataset_size = float("inf")
+    dataset = create_dataset(opt_data)
+
+    opt_autoenc = TimePredictorModel.autoencoder_options(opt_data)
+    autoencoder = create_model(opt_autoenc)
+    autoencoder.setup(opt_autoenc)
+
+    latents, times, paths = [], [], []
+    for i, data in enumerate(dataset):
+        autoencoder.diff_map = autoencoder.image_to_device(data['diff_map'])
+        latents.append(autoencoder.forward_getVector().cpu().numpy())
+        times.append(data['time_period'].numpy())
+        paths.extend(data['A_paths'])
+        if i % 1000 == 0:
+            print('encoding (%05d)-th diff map... %s' % (i, data['A_paths'][0]))
+
+    path = cache_path(opt)
+    np.savez(path, latent=np.concatenate(latents).astype(np.float32), time_period=np.concatenate(times).astype(np.int32),
+             paths=np.array(paths), dataroot=os.path.abspath(opt.dataroot), fingerprint=fingerprint(checkpoint_path(opt)))
+    print('saved %d latent vectors to %s' % (len(paths), path))
+    return path
+
+
+def load_latent_cache(opt):
+    """Return the latent cache for <opt.phase> as a dict of numpy arrays, (re)building it if it is missing or stale.
+
+    The cache is stale when it was built from a different dataroot or from a different autoencoder checkpoint.
+    """
+    path = cache_path(opt)
+    if os.path.exists(path):
+        cache = dict(np.load(path))
+        if str(cache['dataroot']) == os.path.abspath(opt.dataroot) and \
+                str(cache['fingerprint']) == fingerprint(checkpoint_path(opt)):
+            return cache
+        print('latent cache %s is out of date; rebuilding it' % path)
+    build_latent_cache(opt)
+    return dict(np.load(path))
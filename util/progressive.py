@@ -0,0 +1,47 @@
+"""This module implements the progressive-resolution schedule of train.py ('--progressive_sizes', '--progressive_epochs').
+
+The generators and PatchGAN discriminators are fully convolutional, so the early epochs can train on small crops and
+the later ones on the full '--crop_size'. Each stage sets crop_size (and load_size, scaled by the same factor) from its
+first epoch on; train.py rebuilds the dataset, and thus its transforms and DataLoader, when the stage changes.
+"""
+import torch
+from models import networks
+
+
+def parse_schedule(opt):
+    """Return the stages of the schedule as a list of (first epoch, crop_size, load_size), or [] without a schedule.
+
+    The load size of each stage keeps the ratio load_size / crop_size of the options. Every crop size must be accepted
+    by netG and netD (see <networks.size_multiple>).
+    """
+    if not opt.progressive_sizes:
+        return []
+    sizes = [int(size) for size in opt.progressive_sizes.split(',')]
+    epochs = [int(epoch) for epoch in opt.progressive_epochs.split(',')] if opt.progressive_epochs else []
+    assert len(sizes) == len(epochs), '--progressive_epochs needs one first epoch per size in --progressive_sizes'
+    assert all(a < b for a, b in zip(epochs, epochs[1:])), '--progressive_epochs must be increasing'
+    for net in [opt.netG, opt.netD]:
+        multiple, min_size = networks.size_multiple(net, opt.n_layers_D)
+        for size in sizes:
+            assert size % multiple == 0 and size >= min_size, \
+                'crop size %d is not accepted by [%s] (multiples of %d, at least %d)' % (size, net, multiple, min_size)
+    ratio = float(opt.load_size) / opt.crop_size
+    return [(epoch, size, int(round(size * ratio))) for epoch, size in zip(epochs, sizes)]
+
+
+def apply_stage(opt, schedule, epoch):
+    """Set opt.crop_size and opt.load_size for <epoch>; return True if they changed.
+
+    Epochs before the first stage use the first stage. cuDNN autotunes ('cudnn.benchmark') once per input shape, so
+    each new stage is tuned at its first iterations; we only switch it back on, as <BaseModel> does.
+    """
+    if not schedule:
+        return False
+    stage = [stage for stage in schedule if stage[0] <= epoch] or schedule[:1]
+    _, crop_size, load_size = stage[-1]
+    if (opt.crop_size, opt.load_size) == (crop_size, load_size):
+        return False
+    opt.crop_size, opt.load_size = crop_size, load_size
+    if opt.preprocess != 'scale_width':
+        torch.backends.cudnn.benchmark = True
+    return True
@@ -6,12 +6,13 @@ from PIL import Image
 import os
 
 
-def tensor2im(input_image, imtype=np.uint8):
+def tensor2im(input_image, imtype=np.uint8, keep_grayscale=False):
     """"Converts a Tensor array into a numpy image array.
 
     Parameters:
-        input_image (tensor) --  the input image tensor array
-        imtype (type)        --  the desired type of the converted numpy array
+        input_image (tensor)  --  the input image tensor array
+        imtype (type)         --  the desired type of the converted numpy array
+        keep_grayscale (bool) --  return single-channel images as [H, W] arrays instead of tiling them to RGB
     """
     if not isinstance(input_image, np.ndarray):
         if isinstance(input_image, torch.Tensor):  # get the data from a variable
@@ -19,6 +20,8 @@ def tensor2im(input_image, imtype=np.uint8):
         else:
             return input_image
         image_numpy = image_tensor[0].cpu().float().numpy()  # convert it into a numpy array
+        if image_numpy.shape[0] == 1 and keep_grayscale:
+            return ((image_numpy[0] + 1) / 2.0 * 255.0).astype(imtype)
         if image_numpy.shape[0] == 1:  # grayscale to RGB
             image_numpy = np.tile(image_numpy, (3, 1, 1))
         image_numpy = (np.transpose(image_numpy, (1, 2, 0)) + 1) / 2.0 * 255.0  # post-processing: tranpose and scaling
@@ -50,7 +53,7 @@ def save_image(image_numpy, image_path):
     """Save a numpy image to the disk
 
     Parameters:
-        image_numpy (numpy array) -- input numpy array
+        image_numpy (numpy array) -- input numpy array; [H, W] arrays are saved as single-channel images
         image_path (str)          -- the path of the image
     """
     image_pil = Image.fromarray(image_numpy)
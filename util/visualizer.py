@@ -33,10 +33,10 @@ def save_images(webpage, visuals, image_path, aspect_ratio=1.0, width=256):
     ims, txts, links = [], [], []
 
     for label, im_data in visuals.items():
-        im = util.tensor2im(im_data)
+        im = util.tensor2im(im_data, keep_grayscale=True)  # grayscale visuals are saved as single-channel PNGs
         image_name = '%s_%s.png' % (name, label)
         save_path = os.path.join(image_dir, image_name)
-        h, w, _ = im.shape
+        h, w = im.shape[:2]
         if aspect_ratio > 1.0:
             im = imresize(im, (h, int(w * aspect_ratio)), interp='bicubic')
         if aspect_ratio < 1.0:
@@ -163,7 +163,7 @@ class Visualizer():
             self.saved = True
             # save images to the disk
             for label, image in visuals.items():
-                image_numpy = util.tensor2im(image)
+                image_numpy = util.tensor2im(image, keep_grayscale=True)
                 img_path = os.path.join(self.img_dir, 'epoch%.3d_%s.png' % (epoch, label))
                 util.save_image(image_numpy, img_path)
 
@@ -208,7 +208,7 @@ class Visualizer():
             self.create_visdom_connections()
 
     # losses: same format as |losses| of plot_current_losses
-    def print_current_losses(self, epoch, iters, losses, t_comp, t_data):
+    def print_current_losses(self, epoch, iters, losses, t_comp, t_data, t_micro=None):
         """print current losses on console; also save the losses to the disk
 
         Parameters:
@@ -217,8 +217,12 @@ class Visualizer():
             losses (OrderedDict) -- training losses stored in the format of (name, float) pairs
             t_comp (float) -- computational time per data point (normalized by batch_size)
             t_data (float) -- data loading time per data point (normalized by batch_size)
+            t_micro (float list) -- with '--accum_steps', computational time of each recent micro-batch (not normalized)
         """
-        message = '(epoch: %d, iters: %d, time: %.3f, data: %.3f) ' % (epoch, iters, t_comp, t_data)
+        message = '(epoch: %d, iters: %d, time: %.3f, data: %.3f' % (epoch, iters, t_comp, t_data)
+        if t_micro:
+            message += ', micro-batch: %.3f mean, %.3f max over %d' % (sum(t_micro) / len(t_micro), max(t_micro), len(t_micro))
+        message += ') '
         for k, v in losses.items():
             message += '%s: %.3f ' % (k, v)
 